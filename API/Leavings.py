@@ -1,18 +1,24 @@
 from datetime import date
 
 import mysql.connector
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
 from fastapi.security import OAuth2PasswordBearer
-from typing import List
+from typing import List, Optional
 
 from pydantic import BaseModel
 
 from classes import Leavings
-from classes.Leavings import LeaveRequestUpdate, LeaveRequestCreate, LeaveRequestResponse
+from classes.Leavings import LeaveRequestUpdate, LeaveRequestCreate, LeaveRequestResponse, BulkItemResult
 # from classes import Leavings
 # from classes.Leavings import LeaveRequestResponse
-from core.security import get_current_active_user  # Assuming this function is implemented in core.security
-from db.db import get_db
+from core.security import get_current_active_user, get_role_db, get_current_principal, \
+    get_current_principal_detached  # Assuming this function is implemented in core.security
+from core.events import ALL, leave_events
+from core.responses import ndjson_response, rows_response, sse_response
+from core.stats import stats_cache
+from db.db import DB_BULK_MAX_ITEMS, request_connection, run_in_batches
+from db.leaves import LEAVE_PAGE_DEFAULT, LEAVE_PAGE_MAX, fetch_leave_page, stream_leaves, employee_supervisors, \
+    employees_supervisors, leave_owners, publish_leave_events, LEAVE_BY_ID
 
 router = APIRouter()
 
@@ -20,29 +26,67 @@ router = APIRouter()
 
 # Endpoint to create a new leave request (accessible by employees)
 @router.post("/leave/request", status_code=status.HTTP_201_CREATED)
-def create_leave_request(leave_request: LeaveRequestCreate, db=Depends(get_db),
+async def create_leave_request(leave_request: LeaveRequestCreate, db=Depends(get_role_db),
         current_user=Depends(get_current_active_user)  # Enforces JWT token authentication
 ):
     cursor, connection = db
     try:
-        cursor.callproc("create_leave_request", [leave_request.employee_id,leave_request.leave_start_date,leave_request.period_of_absence,leave_request.reason_for_absence,leave_request.type_of_leave,])
-        connection.commit()
+        await cursor.callproc("create_leave_request", [leave_request.employee_id,leave_request.leave_start_date,leave_request.period_of_absence,leave_request.reason_for_absence,leave_request.type_of_leave,])
+        supervisors = await employee_supervisors(cursor, leave_request.employee_id)
+        await connection.commit()
+        stats_cache.invalidate("leaves")
+        leave_events.publish(supervisors, {"type": "created", "employee_id": leave_request.employee_id,
+                                           "leave_start_date": leave_request.leave_start_date,
+                                           "type_of_leave": leave_request.type_of_leave})
 
         return "Leave requested successfully"
 
     except mysql.connector.Error as e:
-        connection.rollback()
+        await connection.rollback()
         raise HTTPException(status_code=500, detail=f"Error creating leave request: {str(e)}")
 
 
+def _create_leave(cursor, leave_request):
+    cursor.callproc("create_leave_request", [leave_request.employee_id, leave_request.leave_start_date,
+                                             leave_request.period_of_absence, leave_request.reason_for_absence,
+                                             leave_request.type_of_leave])
+
+
+# Endpoint to submit many leave requests at once (admin only, e.g. imports from a legacy system)
+@router.post("/leave/request/bulk", response_model=List[BulkItemResult])
+async def create_leave_requests_bulk(leave_requests: List[LeaveRequestCreate], db=Depends(get_role_db),
+                                     principal=Depends(get_current_principal)):
+    if not principal.is_admin:
+        raise HTTPException(status_code=403, detail="Not authorized to submit leave requests in bulk")
+
+    if len(leave_requests) > DB_BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {DB_BULK_MAX_ITEMS} leave requests per call")
+
+    try:
+        errors = await run_in_batches(db, leave_requests, _create_leave)
+        created = [leave_request for leave_request, error in zip(leave_requests, errors) if error is None]
+        supervisors = await employees_supervisors(db[0], [leave_request.employee_id for leave_request in created])
+    except mysql.connector.Error as e:
+        raise HTTPException(status_code=500, detail=f"Error creating leave requests: {str(e)}")
+
+    stats_cache.invalidate("leaves")
+    # Same "created" event as POST /leave/request, for every inserted item
+    for leave_request in created:
+        leave_events.publish(supervisors[leave_request.employee_id],
+                             {"type": "created", "employee_id": leave_request.employee_id,
+                              "leave_start_date": leave_request.leave_start_date,
+                              "type_of_leave": leave_request.type_of_leave})
+    return [BulkItemResult(index=i, success=error is None, error=error) for i, error in enumerate(errors)]
+
+
 # Endpoint to read leave request details (accessible to employees and supervisors)
 @router.get("/leave/request/{leave_request_id}", response_model=LeaveRequestResponse)
-def read_leave_request(leave_request_id: int, db=Depends(get_db), current_user=Depends(get_current_active_user)
+async def read_leave_request(leave_request_id: int, db=Depends(get_role_db), current_user=Depends(get_current_active_user)
         # Enforces JWT token authentication
 ):
     cursor, _ = db
-    cursor.execute("SELECT * FROM leave_request WHERE leave_request_id = %s", (leave_request_id,))
-    leave_request_record = cursor.fetchone()
+    await cursor.execute(LEAVE_BY_ID, (leave_request_id,))
+    leave_request_record = await cursor.fetchone()
     if not leave_request_record:
         raise HTTPException(status_code=404, detail="Leave request not found")
 
@@ -51,50 +95,54 @@ def read_leave_request(leave_request_id: int, db=Depends(get_db), current_user=D
 #
 # Endpoint to update leave request details (accessible by supervisors)
 @router.put("/leave/request/{leave_request_id}", response_model=LeaveRequestResponse)
-def update_leave_request(leave_request_id: int, leave_request: LeaveRequestUpdate, db=Depends(get_db),
-        current_user=Depends(get_current_active_user)  # Enforces JWT token authentication
+async def update_leave_request(leave_request_id: int, leave_request: LeaveRequestUpdate, db=Depends(get_role_db),
+        principal=Depends(get_current_principal)  # Enforces JWT token authentication
 ):
-    if not current_user.is_supervisor:  # Check if the user is a supervisor
+    if not principal.is_supervisor:  # Check if the user is a supervisor
         raise HTTPException(status_code=403, detail="Not authorized to update leave requests")
 
     cursor, connection = db
     try:
-        cursor.execute(
+        await cursor.execute(
             "UPDATE Leave_Request SET Period_of_Absence=%s, Reason_for_Absence=%s, Type_of_Leave=%s, Request_Status=%s "
             "WHERE Leave_Request_ID=%s", (
             leave_request.Period_of_Absence, leave_request.Reason_for_Absence, leave_request.Type_of_Leave,
             leave_request.Request_Status, leave_request_id))
-        connection.commit()
-        cursor.execute("SELECT * FROM Leave_Request WHERE Leave_Request_ID = %s", (leave_request_id,))
-        updated_leave_request = cursor.fetchone()
+        owners = await leave_owners(cursor, [leave_request_id])
+        await connection.commit()
+        stats_cache.invalidate("leaves")
+        publish_leave_events("updated", owners, request_status=leave_request.Request_Status)
+        await cursor.execute("SELECT * FROM Leave_Request WHERE Leave_Request_ID = %s", (leave_request_id,))
+        updated_leave_request = await cursor.fetchone()
 
         if not updated_leave_request:
             raise HTTPException(status_code=404, detail="Leave request not found")
         return updated_leave_request
 
     except mysql.connector.Error as e:
-        connection.rollback()
+        await connection.rollback()
         raise HTTPException(status_code=500, detail=f"Error updating leave request: {str(e)}")
 
 
 # Endpoint to delete a leave request (admin or supervisor only)
 @router.delete("/leave/request/{leave_request_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_leave_request(leave_request_id: int, db=Depends(get_db), current_user=Depends(get_current_active_user)
+async def delete_leave_request(leave_request_id: int, db=Depends(get_role_db), principal=Depends(get_current_principal)
         # Enforces JWT token authentication
 ):
     cursor, connection = db
-    cursor.execute("SELECT is_supervisor FROM user_access WHERE username = %s", (current_user.username,))
-    user_role = cursor.fetchone()
-    if not user_role:  # Check if the user is an admin or supervisor
+    if not (principal.is_admin or principal.is_supervisor):  # Check if the user is an admin or supervisor
         raise HTTPException(status_code=403, detail="Not authorized to delete leave requests")
 
     try:
-        cursor.callproc("delete_request", [leave_request_id,])
-        connection.commit()
+        owners = await leave_owners(cursor, [leave_request_id])
+        await cursor.callproc("delete_request", [leave_request_id,])
+        await connection.commit()
+        stats_cache.invalidate("leaves")
+        publish_leave_events("deleted", owners)
         return "Request deleted successfully"
 
     except mysql.connector.Error as e:
-        connection.rollback()
+        await connection.rollback()
         raise HTTPException(status_code=500, detail=f"Error deleting leave request: {str(e)}")
 
 
@@ -102,102 +150,75 @@ def delete_leave_request(leave_request_id: int, db=Depends(get_db), current_user
 
 
 @router.get("/supervisor/leave_requests", response_model=List[Leavings.LeaveRequestResponse])
-def get_team_leave_requests(db=Depends(get_db), current_user=Depends(get_current_active_user)):
-    cursor, _ = db
-
+async def get_team_leave_requests(principal=Depends(get_current_principal_detached)):
     # Verify that the current user is a supervisor
-    cursor.execute("SELECT is_supervisor FROM user_access WHERE username = %s", (current_user.username,))
-    user_role = cursor.fetchone()
-
-    if not user_role:
+    if not principal.is_supervisor:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail="You do not have permission to view this information")
 
-    # Fetch the supervisor ID - passing only the username as a string
-    cursor.callproc('get_employee_id_by_username', (current_user.username,))
-    supervisor_result = next(cursor.stored_results()).fetchone()
-
-    if not supervisor_result:
+    if not principal.employee_id:
         raise HTTPException(status_code=404, detail="Supervisor ID not found.")
 
-    # Extract supervisor ID from the result
-    supervisor_id = supervisor_result['employee_id']  # Assuming the stored procedure returns a single value, e.g., an employee ID
+    supervisor_id = principal.employee_id
 
-    # Fetch all leave requests for employees reporting to this supervisor
-    cursor.callproc('leave_request_Pending_list', (supervisor_id,))
-    leave_requests = next(cursor.stored_results()).fetchall()
+    # Fetch all leave requests for employees reporting to this supervisor. The
+    # caller is authenticated first, so only one connection is held at a time.
+    async with request_connection(principal.role, read_only=True, session=principal.username) as (cursor, _):
+        await cursor.callproc('leave_request_Pending_list', (supervisor_id,))
+        leave_requests = next(cursor.stored_results()).fetchall()
 
     if not leave_requests:
         raise HTTPException(status_code=404, detail="No leave requests found for your team")
 
-    # Map SQL query results to the LeaveRequestResponse model
-    leave_requests_response = [
-        Leavings.LeaveRequestResponse(
-            first_name =row['first_name'],
-            last_name = row['last_name'],
-            gender = row['gender'],
-            leave_request_id=row['leave_request_id'],
-            employee_id=row['employee_id'],
-            request_date=row['request_date'],
-            leave_start_date=row['leave_start_date'],
-            period_of_absence=row['period_of_absence'],
-            reason_for_absence=row['reason_for_absence'],
-            type_of_leave=row['type_of_leave'],
-            request_status=row['request_status']
-        ) for row in leave_requests
-    ]
-
-    return leave_requests_response
-
-
-
-
-@router.get("/admin_leaves")
-async def all_leaves(db=Depends(get_db), current_user=Depends(get_current_active_user)):
-    cursor, _ = db
+    # Serialize the rows directly; see rows_response
+    return rows_response(leave_requests, Leavings.LeaveRequestResponse)
 
-    # Verify that the current user is a supervisor
-    cursor.execute("SELECT is_admin FROM user_access WHERE username = %s", (current_user.username,))
-    user_role = cursor.fetchone()
 
-    if not user_role or not user_role['is_admin']:
+# Server-sent events for leave requests created, updated, deleted or evaluated in
+# the supervisor's team (admins receive every event). Replaces re-polling
+# /supervisor/leave_requests with one long-lived connection per client.
+@router.get("/supervisor/leave_events")
+async def leave_request_events(principal=Depends(get_current_principal_detached)):
+    if not (principal.is_supervisor or principal.is_admin):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
                             detail="You do not have permission to view this information")
 
-    # Fetch the supervisor ID - passing only the username as a string
-    cursor.callproc('get_employee_id_by_username', (current_user.username,))
-    admin_result = next(cursor.stored_results()).fetchone()
+    if principal.is_admin:
+        return sse_response(leave_events, ALL)
 
-    if not admin_result:
+    if not principal.employee_id:
         raise HTTPException(status_code=404, detail="Supervisor ID not found.")
+    return sse_response(leave_events, principal.employee_id)
+
+
+# Leave history is paginated by leave_request_id: pass the X-Next-Cursor header of
+# one page as `after` to get the next one, or use stream=true for NDJSON
+@router.get("/admin_leaves", response_model=List[Leavings.LeaveRequestResponse])
+async def all_leaves(response: Response, after: Optional[int] = None,
+                     limit: int = Query(LEAVE_PAGE_DEFAULT, ge=1, le=LEAVE_PAGE_MAX),
+                     request_status: Optional[str] = None, from_date: Optional[date] = None,
+                     to_date: Optional[date] = None, stream: bool = False,
+                     principal=Depends(get_current_principal_detached)):
+    # Verify that the current user is an admin
+    if not principal.is_admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="You do not have permission to view this information")
 
-    # Extract supervisor ID from the result
-    admin_id = admin_result[
-        'employee_id']  # Assuming the stored procedure returns a single value, e.g., an employee ID
+    filters = dict(status=request_status, from_date=from_date, to_date=to_date)
+    if stream:
+        return ndjson_response(stream_leaves(principal.role, after=after, session=principal.username, **filters),
+                               Leavings.LeaveRequestResponse)
 
-    # Fetch all leave requests for employees reporting to this supervisor
-    cursor.callproc('employee_leave_details_for_admin')
-    leave_requests = next(cursor.stored_results()).fetchall()
+    # Fetch one page of leave requests
+    async with request_connection(principal.role, read_only=True, session=principal.username) as (cursor, _):
+        leave_requests = await fetch_leave_page(cursor, limit, after=after, **filters)
 
-    if not leave_requests:
+    if not leave_requests and after is None:
         raise HTTPException(status_code=404, detail="No leave requests found for your team")
 
-    # Map SQL query results to the LeaveRequestResponse model
-    leave_requests_response = [
-        Leavings.LeaveRequestResponse(
-            leave_request_id=row['leave_request_id'],
-            employee_id=row['employee_id'],
-            first_name=row['first_name'],
-            last_name=row['last_name'],
-            gender=row['gender'],
-            request_date=row['request_date'],
-            leave_start_date=row['leave_start_date'],
-            period_of_absence=row['period_of_absence'],
-            reason_for_absence=row['reason_for_absence'],
-            type_of_leave=row['type_of_leave'],
-            request_status=row['request_status']
-        ) for row in leave_requests
-    ]
-
-    return leave_requests_response
+    if len(leave_requests) == limit:
+        response.headers["X-Next-Cursor"] = str(leave_requests[-1]['leave_request_id'])
+
+    # Serialize the rows directly; see rows_response
+    return rows_response(leave_requests, Leavings.LeaveRequestResponse, response)
 
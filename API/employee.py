@@ -1,69 +1,86 @@
+import csv
+import os
 import uuid
+from typing import Optional
+
 import mysql.connector
-import asyncio
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from anyio import to_thread
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Query, Request, Response
+from fastapi.responses import FileResponse
 from classes import employee
+from core.jobs import PublishedValue
 from core.middleware import logger
-from core.security import get_current_active_user
-from db.db import get_db
+from core.photos import decode_inline, media_type, photo_path, save_upload, store_photo, thumbnail_path
+from core.responses import not_modified
+from core.stats import stats_cache
+from db.db import db_connection, prepared, request_connection
+from db.employee_import import add_employee_params, check_readable, import_employees, import_format, read_rows
+from core.security import get_current_active_user, get_role_db, get_current_principal, invalidate_user, user_cache, \
+    get_current_user_detached, get_current_principal_detached
 
 # Initialize the router
 router = APIRouter()
 
-# Polling helper function
-async def poll_endpoint(func, check_condition, delay=5, max_retries=5, *args, **kwargs):
-    retries = 0
-    while retries < max_retries:
-        response = await func(*args, **kwargs)
-        if check_condition(response):
-            return response
-        await asyncio.sleep(delay)
-        retries += 1
-    raise HTTPException(status_code=408, detail="Request timed out")
+# The employee of the month is computed by a background job (started in main.py)
+# every EOTM_REFRESH_SECONDS and served from memory
+EOTM_REFRESH_SECONDS = float(os.getenv("EOTM_REFRESH_SECONDS", 3600))
+employee_of_month = PublishedValue()
+
+
+async def refresh_employee_of_the_month():
+    async with db_connection(read_only=True) as (cursor, _):
+        await cursor.callproc("employee_of_the_month")
+        result = next(cursor.stored_results()).fetchone()
+    if employee_of_month.publish(result):
+        logger.info(f"Employee of the month: {result}")
+
 
 # Endpoint for creating a new employee
 @router.post("/employee/new", status_code=status.HTTP_201_CREATED)
-async def create_employee(employee: employee.EmployeeCreate, db=Depends(get_db),
-                          current_user=Depends(get_current_active_user)):
+async def create_employee(employee: employee.EmployeeCreate, db=Depends(get_role_db),
+                          current_user=Depends(get_current_active_user), principal=Depends(get_current_principal)):
     cursor, connection = db
     logger.info(f"Attempting to create employee: {employee.employee_id}")
 
     try:
-        # Fetch the employee_id of the current user
-        cursor.callproc("get_employee_id_by_username", [current_user.username])
-        user_record = next(cursor.stored_results()).fetchone()
-
-        if not user_record:
+        if not principal.employee_id:
             raise HTTPException(status_code=404, detail="User not found")
 
-        employee_id = user_record["employee_id"]
+        employee_id = principal.employee_id
         employee.employee_id = str(uuid.uuid4())
 
-        # Check authorization using a user-defined function
-        if current_user.employee_id != employee_id and not cursor.callproc("is_admin", [current_user.username]):
+        # Check authorization
+        if current_user.employee_id != employee_id and not principal.is_admin:
             raise HTTPException(status_code=403, detail="Not authorized to add an employee")
 
+        # A photo sent inline goes to the photo store once the row is committed; the
+        # row only keeps its reference
+        try:
+            employee.profile_photo, photo = await to_thread.run_sync(decode_inline, employee.profile_photo)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
         # Call the 'add_employee' stored procedure
-        cursor.callproc("add_employee", [employee.employee_id, employee.first_name, employee.last_name,
-                                         employee.birthday, employee.nic, employee.gender, employee.marital_status,
-                                         employee.number_of_dependents, employee.address, employee.contact_number,
-                                         employee.business_email, employee.job_title, employee.employee_status,
-                                         employee.department_name, employee.branch_name, employee.profile_photo,
-                                         employee.emergency_contact_name, employee.emergency_contact_nic,
-                                         employee.emergency_contact_address, employee.emergency_contact_number])
-        connection.commit()
+        await cursor.callproc("add_employee", add_employee_params(employee))
+        await connection.commit()
+        stats_cache.invalidate("employees")
+        if photo is not None:
+            await to_thread.run_sync(store_photo, employee.profile_photo, photo)
 
         # Fetch the newly created employee record using a stored procedure
-        cursor.callproc("select_employee_details", [employee.employee_id])
+        await cursor.callproc("select_employee_details", [employee.employee_id])
         new_employee = next(cursor.stored_results()).fetchone()
         if not new_employee:
             raise HTTPException(status_code=404, detail="Employee creation failed")
 
         return {"message": "Employee created successfully"}
 
+    except HTTPException:
+        raise
+
     except mysql.connector.Error as e:
         logger.error(f"Database error while creating employee: {str(e)}")
-        connection.rollback()
+        await connection.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error: {str(e)}")
 
     except Exception as e:
@@ -71,75 +88,170 @@ async def create_employee(employee: employee.EmployeeCreate, db=Depends(get_db),
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Unexpected error: {str(e)}")
 
 
+# Endpoint for onboarding many employees from a CSV, JSON or JSON Lines upload
+@router.post("/employee/import", response_model=employee.EmployeeImportReport)
+async def import_employees_file(file: UploadFile = File(...), db=Depends(get_role_db),
+                                principal=Depends(get_current_principal)):
+    if not principal.is_admin:
+        raise HTTPException(status_code=403, detail="Not authorized to import employees")
+
+    fmt = import_format(file.filename, file.content_type)
+    if fmt is None:
+        raise HTTPException(status_code=415, detail="Upload a .csv, .json or .jsonl file")
+
+    try:
+        await to_thread.run_sync(check_readable, file.file, fmt)
+        report = await import_employees(db, read_rows(file.file, fmt))
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Could not read the uploaded file: {str(e)}")
+    except mysql.connector.Error as e:
+        logger.error(f"Database error while importing employees: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error: {str(e)}")
+
+    if report.imported:
+        stats_cache.invalidate("employees")
+    logger.info(f"Imported {report.imported} of {report.total} employees")
+    return report
+
+
 @router.get("/employee_of_month")
-async def get_employee_of_the_month_polling(background_tasks: BackgroundTasks, db=Depends(get_db), current_user=Depends(get_current_active_user)):
-    async def fetch_employee_of_month():
-        cursor, connection = db
-        cursor.callproc("employee_of_the_month")
-        employee_of_month = next(cursor.stored_results()).fetchone()
-        if employee_of_month:
-            logger.info(f"Employee of the month: {employee_of_month}")
-            return employee_of_month
-        return None
-
-    # Define a condition function to stop polling when an employee of the month is found
-    check_condition = lambda result: result is not None
-
-    # Schedule polling with a delay and a maximum number of retries
+async def get_employee_of_the_month(current_user=Depends(get_current_user_detached)):
     try:
-        employee_of_month = await poll_endpoint(fetch_employee_of_month, check_condition, delay=5, max_retries=10)
-        return {"employee_of_the_month": employee_of_month}
-    except HTTPException as e:
-        logger.error("Error during polling for employee of the month")
-        raise e
+        # Only the very first request after startup can beat the background job
+        if not employee_of_month.version:
+            await refresh_employee_of_the_month()
+    except mysql.connector.Error as e:
+        logger.error(f"Database error while fetching employee of the month: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error: {str(e)}")
+
+    if employee_of_month.value is None:
+        raise HTTPException(status_code=404, detail="Employee of the month not available yet")
+    return {"employee_of_the_month": employee_of_month.value, "version": employee_of_month.version}
+
+
+# Long-poll: returns as soon as a value newer than `since` is published, or the
+# current value after `timeout` seconds. Holds no database connection while waiting.
+@router.get("/employee_of_month/wait")
+async def wait_for_employee_of_the_month(since: int = 0, timeout: float = Query(30, gt=0, le=60),
+                                         current_user=Depends(get_current_user_detached)):
+    changed = await employee_of_month.wait_for_change(since, timeout)
+    return {"employee_of_the_month": employee_of_month.value, "version": employee_of_month.version,
+            "changed": changed}
 
 # Additional endpoints (read_employee, delete_employee, update_employee, etc.) remain unchanged.
 
 @router.delete("/employee/{employee_id}", status_code=status.HTTP_200_OK)
-async def delete_employee(employee_id: str, db=Depends(get_db), current_user=Depends(get_current_active_user)):
+async def delete_employee(employee_id: str, db=Depends(get_role_db), current_user=Depends(get_current_active_user),
+                          principal=Depends(get_current_principal)):
     cursor, connection = db
 
     try:
-        logger.info(f"Attempting to delete employee with ID: {employee_id} by user: {current_user.username}")
+        logger.debug("Attempting to delete employee with ID: %s by user: %s", employee_id, current_user.username)
 
-        cursor.callproc("get_usernme_by_employee_id", [employee_id])
+        await cursor.callproc("get_usernme_by_employee_id", [employee_id])
         username = next(cursor.stored_results()).fetchone()
 
         if not username:
-            logger.warning(f"Username for employee_id {employee_id} not found")
+            logger.warning("Username for employee_id %s not found", employee_id)
             raise HTTPException(status_code=404, detail="Employee username not found")
 
-        cursor.callproc("get_employee_id_by_username", [current_user.username])
-        user_record = next(cursor.stored_results()).fetchone()
-
-        if not user_record:
-            logger.error(f"Current user {current_user.username} not found")
+        if not principal.employee_id:
+            logger.error("Current user %s not found", current_user.username)
             raise HTTPException(status_code=404, detail="Current user not found")
 
-        current_user_employee_id = user_record['employee_id']
+        current_user_employee_id = principal.employee_id
         employee_id_to_delete = employee_id
 
-        logger.info(f"User {current_user.username} is attempting to delete employee with ID: {employee_id_to_delete}")
-
-        cursor.callproc("is_admin", [current_user.username])
-        is_admin = next(cursor.stored_results()).fetchone()
-
-        if not is_admin:
-            logger.warning(f"User {current_user.username} is not authorized to delete employee {employee_id_to_delete}")
+        if not principal.is_admin:
+            logger.warning("User %s is not authorized to delete employee %s", current_user.username,
+                           employee_id_to_delete)
             raise HTTPException(status_code=403, detail="Not authorized to delete this employee")
 
-        cursor.callproc("delete_employee", [current_user_employee_id, employee_id_to_delete])
-        connection.commit()
+        await cursor.callproc("delete_employee", [current_user_employee_id, employee_id_to_delete])
+        await connection.commit()
+        stats_cache.invalidate("employees", "leaves")
 
-        logger.info(f"Employee {employee_id_to_delete} deleted successfully by user {current_user.username}")
+        # Drop the deleted employee's cached login so their token stops working
+        if username.get('username'):
+            invalidate_user(username['username'])
+        else:
+            user_cache.clear()
+
+        logger.info("Employee %s deleted successfully by user %s", employee_id_to_delete, current_user.username,
+                    extra={"employee_id": employee_id_to_delete, "username": current_user.username})
 
         return {"message": f"Employee {employee_id_to_delete} deleted successfully"}
 
     except mysql.connector.Error as e:
         logger.error(f"Database error while deleting employee: {str(e)}")
-        connection.rollback()
+        await connection.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error: {str(e)}")
 
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unexpected error occurred")
+
+
+PHOTO_BY_EMPLOYEE = prepared("SELECT profile_photo FROM employee WHERE employee_id = %s")
+SET_EMPLOYEE_PHOTO = prepared("UPDATE employee SET profile_photo = %s WHERE employee_id = %s")
+
+
+# Upload a profile photo (JPEG, PNG or WebP). The file is streamed into the photo
+# store and only its reference is saved on the employee; a connection is borrowed
+# just for the lookup and, after the upload, for the update. The employee is looked
+# up first so an unknown id never leaves a blob in the store.
+@router.put("/employee/{employee_id}/photo")
+async def upload_profile_photo(employee_id: str, file: UploadFile = File(...),
+                               principal=Depends(get_current_principal_detached)):
+    if employee_id != principal.employee_id and not principal.is_admin:
+        raise HTTPException(status_code=403, detail="Not authorized to change this employee's photo")
+
+    try:
+        async with request_connection(principal.role, read_only=True, session=principal.username) as (cursor, _):
+            await cursor.execute(PHOTO_BY_EMPLOYEE, (employee_id,))
+            if not await cursor.fetchone():
+                raise HTTPException(status_code=404, detail="Employee not found")
+
+        reference = await save_upload(file)
+        async with request_connection(principal.role) as (cursor, connection):
+            await cursor.execute(SET_EMPLOYEE_PHOTO, (reference, employee_id))
+            await connection.commit()
+    except mysql.connector.Error as e:
+        logger.error(f"Database error while saving profile photo: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error: {str(e)}")
+
+    return {"profile_photo": reference, "url": f"/photos/{reference}"}
+
+
+# Photo files are sent with FileResponse, which streams from disk (or uses the
+# server's zero-copy sendfile extension when available) instead of loading them.
+# `size` selects a cached thumbnail.
+async def _photo_response(reference, size, headers):
+    path = await thumbnail_path(reference, size) if size else photo_path(reference)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Photo not found")
+    return FileResponse(path, media_type=media_type(reference), headers=headers)
+
+
+@router.get("/employee/{employee_id}/photo")
+async def employee_photo(employee_id: str, request: Request, response: Response, size: Optional[int] = None,
+                         principal=Depends(get_current_principal_detached)):
+    async with request_connection(principal.role) as (cursor, _):
+        await cursor.execute(PHOTO_BY_EMPLOYEE, (employee_id,))
+        row = await cursor.fetchone()
+    if not row or not row['profile_photo']:
+        raise HTTPException(status_code=404, detail="Photo not found")
+
+    # The employee's photo can change, so clients revalidate; the ETag is the content hash
+    reference = row['profile_photo']
+    etag = f'"{reference.split(".")[0]}-{size or "full"}"'
+    cached = not_modified(request, response, etag)
+    if cached:
+        return cached
+    return await _photo_response(reference, size, {"ETag": etag, "Cache-Control": "private, no-cache"})
+
+
+# Content-addressed URL: the bytes behind it never change
+@router.get("/photos/{reference}")
+async def photo(reference: str, size: Optional[int] = None, current_user=Depends(get_current_user_detached)):
+    return await _photo_response(reference, size, {"Cache-Control": "private, max-age=31536000, immutable"})
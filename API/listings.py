@@ -1,37 +1,66 @@
+import asyncio
 import logging
-from typing import List
+from datetime import date
+from typing import List, Optional
 
 import mysql.connector
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
 
 from classes import supervisor
 from classes.Leavings import LeaveRequestResponse
-from classes.employee import Pie_graph_gender, Pie_graph_pay_grade, Pie_graph_role, Pie_graph_pay_department
+from classes.employee import Pie_graph_gender, Pie_graph_pay_grade, Pie_graph_role, Pie_graph_pay_department, Dashboard
 from classes.supervisor import supervisor_, TeamMember
 from core.middleware import logger
-from core.security import get_current_active_user
-from db.db import get_db
+from core.security import get_current_user_detached, get_current_principal_detached
+from core.responses import ndjson_response, not_modified, rows_response
+from core.stats import stats_cache, proc_loader
+from core.versions import resource_versions
+from db.db import request_connection
+from db.leaves import LEAVE_PAGE_DEFAULT, LEAVE_PAGE_MAX, fetch_leave_page, stream_leaves
 
 
 router = APIRouter()
 
-
+# Dashboard aggregates are served from the shared statistics cache; "employees" and
+# "leaves" are invalidated by the endpoints that change them
+stats_cache.register("on_leave", proc_loader("get_leave_count", one=True), tags=("leaves",))
+stats_cache.register("today_full_time", proc_loader("get_fulltime_employee_count_presentage", one=True),
+                     tags=("employees", "leaves"))
+stats_cache.register("today_half_time", proc_loader("get_parttime_employee_count_presentage", one=True),
+                     tags=("employees", "leaves"))
+stats_cache.register("pie_graph_gender", proc_loader("employees_by_gender_presentages"), tags=("employees",))
+stats_cache.register("pie_graph_paygrade", proc_loader("employees_by_pay_grade_presentages"), tags=("employees",))
+stats_cache.register("pie_graph_role", proc_loader("employees_by_role_presentages"), tags=("employees",))
+stats_cache.register("pie_graph_department", proc_loader("employee_by_department_presentages"),
+                     tags=("employees",))
+DASHBOARD_STATS = ("on_leave", "today_full_time", "today_half_time", "pie_graph_gender", "pie_graph_paygrade",
+                   "pie_graph_role", "pie_graph_department")
+
+
+# ETag for a response built from the given aggregates: it changes only once a
+# reloaded value is actually being served
+def stats_etag(*names):
+    return resource_versions.etag(scope=[(name, stats_cache.version(name)) for name in names])
+
+
+# The listings below answer If-None-Match with 304 from the change counters alone;
+# a connection is only borrowed when the body has to be rebuilt
 @router.get("/all_admins")
-async def admin_list(db=Depends(get_db), current_user=Depends(get_current_active_user)):
-    cursor, _ = db
-
+async def admin_list(request: Request, response: Response, principal=Depends(get_current_principal_detached)):
     try:
         # Check if the current user is an admin (can be done before fetching admins)
-        cursor.callproc("is_admin", [current_user.username])
-        admin_record = next(cursor.stored_results()).fetchone()
-        is_admin = admin_record["is_admin"] if admin_record else False
-
-        if not is_admin:
+        if not principal.is_admin:
             raise HTTPException(status_code=403, detail="Not authorized to view admin list")
 
+        cached = not_modified(request, response, resource_versions.etag("employees", "users"))
+        if cached:
+            return cached
+
         # Fetch all admin details using the 'admins' stored procedure
-        cursor.callproc("admins")
-        admin_records = next(cursor.stored_results()).fetchall()
+        async with request_connection(principal.role, read_only=True, session=principal.username) as (cursor, _):
+            await cursor.callproc("admins")
+            admin_records = next(cursor.stored_results()).fetchall()
 
         if not admin_records:
             raise HTTPException(status_code=404, detail="No admins found")
@@ -57,46 +86,35 @@ async def admin_list(db=Depends(get_db), current_user=Depends(get_current_active
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Unexpected error: {str(e)}")
 
 @router.get("/supervisors", response_model=List[supervisor.supervisor_])
-async def all_supervisors(db=Depends(get_db), current_user=Depends(get_current_active_user)):
-    cursor, connection = db
+async def all_supervisors(request: Request, response: Response, principal=Depends(get_current_principal_detached)):
     try:
-        # Check admin status
-        cursor.execute("SELECT is_admin FROM user_access WHERE username = %s", (current_user.username,))
-        is_admin = cursor.fetchone()
-
-        # Log admin status to verify the fetch
-        logger.info(f"Admin status for user {current_user.username}: {is_admin}")
-
         # Ensure the user has admin rights
-        if not is_admin :
+        if not principal.is_admin:
             raise HTTPException(status_code=403, detail="Not authorized to view this information")
 
+        cached = not_modified(request, response, resource_versions.etag("employees"))
+        if cached:
+            return cached
+
         # Call the stored procedure `show_supervisor`
-        logger.info("Calling stored procedure 'show_supervisor'")
-        cursor.callproc('show_supervisor')
+        logger.debug("Calling stored procedure 'show_supervisor'")
+        async with request_connection(principal.role, read_only=True, session=principal.username) as (cursor, _):
+            await cursor.callproc('show_supervisor')
 
-        # Fetch the results from the procedure
-        result_cursor = next(cursor.stored_results(), None)
+            # Fetch the results from the procedure
+            result_cursor = next(cursor.stored_results(), None)
 
-        if result_cursor is None:
-            logger.error("No result set returned from stored procedure 'show_supervisor'")
-            raise HTTPException(status_code=500, detail="No results returned from the stored procedure")
+            if result_cursor is None:
+                logger.error("No result set returned from stored procedure 'show_supervisor'")
+                raise HTTPException(status_code=500, detail="No results returned from the stored procedure")
 
-        supervisors = result_cursor.fetchall()
+            supervisors = result_cursor.fetchall()
 
         # Log fetched supervisors for debugging
-        logger.info(f"Supervisors fetched: {supervisors}")
-
-        # Build the response
-        all_supervisor_response = [
-            supervisor_(
-                supervisor_id=row['supervisor_id'],
-                first_name=row['first_name'],
-                last_name = row['last_name']
-            ) for row in supervisors
-        ]
+        logger.debug("Supervisors fetched: %s", supervisors)
 
-        return all_supervisor_response
+        # Serialize the rows directly; see rows_response
+        return rows_response(supervisors, supervisor_, response)
 
     except mysql.connector.Error as e:
         logger.error(f"Database error while fetching supervisors: {str(e)}")
@@ -108,56 +126,39 @@ async def all_supervisors(db=Depends(get_db), current_user=Depends(get_current_a
 
 
 @router.get("/supervisor/team/",response_model=List[TeamMember])
-async def supervisor_team(db=Depends(get_db), current_user=Depends(get_current_active_user)):
-    cursor, connection = db
+async def supervisor_team(request: Request, response: Response, principal=Depends(get_current_principal_detached)):
     try:
-        # Check admin status
-        cursor.execute("SELECT is_supervisor FROM user_access WHERE username = %s", (current_user.username,))
-        is_supervisor = cursor.fetchone()
-
-        # Log admin status to verify the fetch
-        logger.info(f"Admin status for user {current_user.username}: {is_supervisor}")
-
-        # Ensure the user has admin rights
-        if not is_supervisor:
+        # Ensure the user has supervisor rights
+        if not principal.is_supervisor:
             raise HTTPException(status_code=403, detail="Not authorized to view this information")
-        logger.info("Calling stored procedure 'get_employee_id_by_username'")
-        cursor.callproc('get_employee_id_by_username', [current_user.username, ])
 
-        # Fetch the results from the procedure
-        stored_result = next(cursor.stored_results(), None)
+        if not principal.employee_id:
+            raise HTTPException(status_code=404, detail="Supervisor ID not found")
 
-        if not stored_result:
-            logger.error("No result set returned from the stored procedure 'get_employee_id_by_username'")
-            raise HTTPException(status_code=500, detail="No results returned from the stored procedure")
+        supervisor_id = principal.employee_id
+        cached = not_modified(request, response, resource_versions.etag("employees", scope=supervisor_id))
+        if cached:
+            return cached
 
-        supervisor_id = stored_result.fetchone()['employee_id']  # Extract supervisor_id from the result
         # Call the stored procedure `show_supervisor`
-        logger.info("Calling stored procedure 'show_all_employee_team'")
-        cursor.callproc('employee_team',[supervisor_id,])
+        logger.debug("Calling stored procedure 'show_all_employee_team'")
+        async with request_connection(principal.role, read_only=True, session=principal.username) as (cursor, _):
+            await cursor.callproc('employee_team',[supervisor_id,])
 
-        # Fetch the results from the procedure
-        result_cursor = next(cursor.stored_results(), None)
+            # Fetch the results from the procedure
+            result_cursor = next(cursor.stored_results(), None)
 
-        if result_cursor is None:
-            logger.error("No result set returned from stored procedure 'show_employee_team'")
-            raise HTTPException(status_code=500, detail="No results returned from the stored procedure")
+            if result_cursor is None:
+                logger.error("No result set returned from stored procedure 'show_employee_team'")
+                raise HTTPException(status_code=500, detail="No results returned from the stored procedure")
 
-        employee_team = result_cursor.fetchall()
+            employee_team = result_cursor.fetchall()
 
         # Log fetched supervisors for debugging
-        logger.info(f"employees fetched: {employee_team}")
-
-        # Build the response
-        all_supervisor_response = [
-            TeamMember(
-                employee_id=row['employee_id'],
-                first_name=row['first_name'],
-                last_name=row['last_name']
-            ) for row in employee_team
-        ]
+        logger.debug("employees fetched: %s", employee_team)
 
-        return all_supervisor_response
+        # Serialize the rows directly; see rows_response
+        return rows_response(employee_team, TeamMember, response)
 
     except mysql.connector.Error as e:
         logger.error(f"Database error while fetching supervisors: {str(e)}")
@@ -167,60 +168,40 @@ async def supervisor_team(db=Depends(get_db), current_user=Depends(get_current_a
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Unexpected error: {str(e)}")
 
+# Paginated like /admin_leaves: `after` takes the previous page's X-Next-Cursor header
 @router.get("/team_leaves", response_model=List[LeaveRequestResponse])
-async def all_leaves(db=Depends(get_db), current_user=Depends(get_current_active_user)):
-    cursor, connection = db
+async def all_leaves(response: Response, after: Optional[int] = None,
+                     limit: int = Query(LEAVE_PAGE_DEFAULT, ge=1, le=LEAVE_PAGE_MAX),
+                     request_status: Optional[str] = None, from_date: Optional[date] = None,
+                     to_date: Optional[date] = None, stream: bool = False,
+                     principal=Depends(get_current_principal_detached)):
     try:
-        # Check if the current user is a supervisor
-        cursor.execute("SELECT is_supervisor FROM user_access WHERE username = %s", (current_user.username,))
-        is_supervisor = cursor.fetchone()
-
-        # Log admin status to verify the fetch
-        logger.info(f"Supervisor status for user {current_user.username}: {is_supervisor}")
-
         # Ensure the user has supervisor rights
-        if not is_supervisor :
+        if not principal.is_supervisor:
             raise HTTPException(status_code=403, detail="Not authorized to view this information")
 
-        # Call the stored procedure to get the supervisor's employee ID
-        logger.info("Calling stored procedure 'get_employee_id_by_username'")
-        cursor.callproc('get_employee_id_by_username', [current_user.username,])
+        if not principal.employee_id:
+            raise HTTPException(status_code=404, detail="Supervisor ID not found")
 
-        # Fetch the results from the procedure
-        stored_result = next(cursor.stored_results(), None)
+        supervisor_id = principal.employee_id
 
-        if not stored_result:
-            logger.error("No result set returned from the stored procedure 'get_employee_id_by_username'")
-            raise HTTPException(status_code=500, detail="No results returned from the stored procedure")
+        # Log fetched supervisor ID for debugging
+        logger.debug("Supervisor ID fetched: %s", supervisor_id)
 
-        supervisor_id = stored_result.fetchone()['employee_id']  # Extract supervisor_id from the result
+        filters = dict(supervisor_id=supervisor_id, status=request_status, from_date=from_date, to_date=to_date)
+        if stream:
+            return ndjson_response(stream_leaves(principal.role, after=after, session=principal.username, **filters),
+                                   LeaveRequestResponse)
 
-        # Log fetched supervisor ID for debugging
-        logger.info(f"Supervisor ID fetched: {supervisor_id}")
-
-        # Query to get leave requests for employees under the supervisor
-        cursor.execute("""
-            SELECT * FROM leave_request
-            WHERE employee_id IN (SELECT employee_id FROM supervisor WHERE supervisor.supervisor_id = %s);
-        """, (supervisor_id,))
-
-        team_leaves = cursor.fetchall()
-
-        # Build the response
-        all_leaves_requests = [
-            LeaveRequestResponse(
-                leave_request_id=row['leave_request_id'],
-                employee_id=row['employee_id'],
-                request_date=row['request_date'],
-                leave_start_date=row['leave_start_date'],
-                period_of_absence=row['period_of_absence'],
-                reason_for_absence=row['reason_for_absence'],
-                type_of_leave=row['type_of_leave'],
-                request_status=row['request_status']
-            ) for row in team_leaves
-        ]
+        # Query to get one page of leave requests for employees under the supervisor
+        async with request_connection(principal.role, read_only=True, session=principal.username) as (cursor, _):
+            team_leaves = await fetch_leave_page(cursor, limit, after=after, **filters)
 
-        return all_leaves_requests
+        if len(team_leaves) == limit:
+            response.headers["X-Next-Cursor"] = str(team_leaves[-1]['leave_request_id'])
+
+        # Serialize the rows directly; see rows_response
+        return rows_response(team_leaves, LeaveRequestResponse, response)
 #
     except mysql.connector.Error as e:
         logger.error(f"Database error while fetching leaves: {str(e)}")
@@ -231,32 +212,25 @@ async def all_leaves(db=Depends(get_db), current_user=Depends(get_current_active
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Unexpected error: {str(e)}")
 
 @router.get("/on_leave")
-async def get_on_leave(db=Depends(get_db), current_user=Depends(get_current_active_user)):
-    cursor, connection = db
+async def get_on_leave(request: Request, response: Response, principal=Depends(get_current_principal_detached)):
     try:
-        # Fetch the employee_id of the current user
-        cursor.callproc("get_employee_id_by_username", [current_user.username])
-        user_record = next(cursor.stored_results()).fetchone()
-
-        # Fetch the employee_id of the employee to be deleted
-        cursor.callproc("get_leave_count")
-        on_leave = next(cursor.stored_results()).fetchone()
-
-        if not user_record:
+        if not principal.employee_id:
             raise HTTPException(status_code=404, detail="User not found")
 
+        on_leave = await stats_cache.get("on_leave")
+        cached = not_modified(request, response, stats_etag("on_leave"))
+        if cached:
+            return cached
+
         if not on_leave:
             raise HTTPException(status_code=404, detail="Employee not found")
 
-        connection.commit()
-
         logger.info(f"number of employee on leave->")
 
         return {"message": on_leave}
 
     except mysql.connector.Error as e:
         logger.error(f"Database error while fetching  data: {str(e)}")
-        connection.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error: {str(e)}")
 
     except Exception as e:
@@ -265,32 +239,25 @@ async def get_on_leave(db=Depends(get_db), current_user=Depends(get_current_acti
 
 
 @router.get("/today_full_time")
-def get_on_fulltime(db=Depends(get_db), current_user=Depends(get_current_active_user)):
-    cursor, connection = db
+async def get_on_fulltime(request: Request, response: Response, principal=Depends(get_current_principal_detached)):
     try:
-        # Fetch the employee_id of the current user
-        cursor.callproc("get_employee_id_by_username", [current_user.username])
-        user_record = next(cursor.stored_results()).fetchone()
-
-        # Fetch the employee_id of the employee to be deleted
-        cursor.callproc("get_fulltime_employee_count_presentage")
-        full_time = next(cursor.stored_results()).fetchone()
-
-        if not user_record:
+        if not principal.employee_id:
             raise HTTPException(status_code=404, detail="User not found")
 
+        full_time = await stats_cache.get("today_full_time")
+        cached = not_modified(request, response, stats_etag("today_full_time"))
+        if cached:
+            return cached
+
         if not full_time:
             raise HTTPException(status_code=404, detail="Employee not found")
 
-        connection.commit()
-
         logger.info(f"number of employee full time-->")
 
         return {"message": full_time}
 
     except mysql.connector.Error as e:
         logger.error(f"Database error while fetching  data: {str(e)}")
-        connection.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error: {str(e)}")
 
     except Exception as e:
@@ -299,32 +266,25 @@ def get_on_fulltime(db=Depends(get_db), current_user=Depends(get_current_active_
 
 
 @router.get("/today_half_time")
-def get_on_halftome(db=Depends(get_db), current_user=Depends(get_current_active_user)):
-    cursor, connection = db
+async def get_on_halftome(request: Request, response: Response, principal=Depends(get_current_principal_detached)):
     try:
-        # Fetch the employee_id of the current user
-        cursor.callproc("get_employee_id_by_username", [current_user.username])
-        user_record = next(cursor.stored_results()).fetchone()
-
-        # Fetch the employee_id of the employee to be deleted
-        cursor.callproc("get_parttime_employee_count_presentage")
-        part_time = next(cursor.stored_results()).fetchone()
-
-        if not user_record:
+        if not principal.employee_id:
             raise HTTPException(status_code=404, detail="User not found")
 
+        part_time = await stats_cache.get("today_half_time")
+        cached = not_modified(request, response, stats_etag("today_half_time"))
+        if cached:
+            return cached
+
         if not part_time:
             raise HTTPException(status_code=404, detail="Employee not found")
 
-        connection.commit()
-
         logger.info(f"number of employee part time-->")
 
         return {"message": part_time}
 
     except mysql.connector.Error as e:
         logger.error(f"Database error while fetching  data: {str(e)}")
-        connection.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error: {str(e)}")
 
     except Exception as e:
@@ -334,19 +294,16 @@ def get_on_halftome(db=Depends(get_db), current_user=Depends(get_current_active_
 
 
 @router.get("/pie_graph_gender", response_model=List[Pie_graph_gender])
-def graph_by_gender(db=Depends(get_db), current_user=Depends(get_current_active_user)):
-    cursor, connection = db
+async def graph_by_gender(request: Request, response: Response, principal=Depends(get_current_principal_detached)):
     try:
-        # Fetch the employee_id of the current user
-        cursor.callproc("get_employee_id_by_username", [current_user.username])
-        user_record = next(cursor.stored_results()).fetchone()
-
-        if not user_record:
+        if not principal.employee_id:
             raise HTTPException(status_code=404, detail="User not found")
 
         # Fetch the gender percentages for employees
-        cursor.callproc("employees_by_gender_presentages")
-        results = next(cursor.stored_results()).fetchall()  # Assuming multiple rows are returned
+        results = await stats_cache.get("pie_graph_gender")
+        cached = not_modified(request, response, stats_etag("pie_graph_gender"))
+        if cached:
+            return cached
 
         if not results:
             raise HTTPException(status_code=404, detail="No gender data found")
@@ -361,7 +318,6 @@ def graph_by_gender(db=Depends(get_db), current_user=Depends(get_current_active_
 
     except mysql.connector.Error as e:
         logger.error(f"Database error while fetching graph data: {str(e)}")
-        connection.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error: {str(e)}")
 
     except Exception as e:
@@ -372,19 +328,16 @@ def graph_by_gender(db=Depends(get_db), current_user=Depends(get_current_active_
 
 
 @router.get("/pie_graph_paygrade", response_model=List[Pie_graph_pay_grade])
-def graph_by_paygrade(db=Depends(get_db), current_user=Depends(get_current_active_user)):
-    cursor, connection = db
+async def graph_by_paygrade(request: Request, response: Response, principal=Depends(get_current_principal_detached)):
     try:
-        # Fetch the employee_id of the current user
-        cursor.callproc("get_employee_id_by_username", [current_user.username])
-        user_record = next(cursor.stored_results()).fetchone()
-
-        if not user_record:
+        if not principal.employee_id:
             raise HTTPException(status_code=404, detail="User not found")
 
         # Fetch the pay grade percentages for employees
-        cursor.callproc("employees_by_pay_grade_presentages")
-        paygrade_results = next(cursor.stored_results()).fetchall()  # Assuming multiple rows are returned
+        paygrade_results = await stats_cache.get("pie_graph_paygrade")
+        cached = not_modified(request, response, stats_etag("pie_graph_paygrade"))
+        if cached:
+            return cached
 
         if not paygrade_results:
             raise HTTPException(status_code=404, detail="No pay grade data found")
@@ -401,7 +354,6 @@ def graph_by_paygrade(db=Depends(get_db), current_user=Depends(get_current_activ
 
     except mysql.connector.Error as e:
         logger.error(f"Database error while fetching graph data: {str(e)}")
-        connection.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error: {str(e)}")
 
     except Exception as e:
@@ -410,19 +362,16 @@ def graph_by_paygrade(db=Depends(get_db), current_user=Depends(get_current_activ
 
 
 @router.get("/pie_graph_role", response_model=List[Pie_graph_role])
-def graph_by_role(db=Depends(get_db), current_user=Depends(get_current_active_user)):
-    cursor, connection = db
+async def graph_by_role(request: Request, response: Response, principal=Depends(get_current_principal_detached)):
     try:
-        # Fetch the employee_id of the current user
-        cursor.callproc("get_employee_id_by_username", [current_user.username])
-        user_record = next(cursor.stored_results()).fetchone()
-
-        if not user_record:
+        if not principal.employee_id:
             raise HTTPException(status_code=404, detail="User not found")
 
         # Fetch the role percentages for employees
-        cursor.callproc("employees_by_role_presentages")
-        role_results = next(cursor.stored_results()).fetchall()  # Assuming multiple rows are returned
+        role_results = await stats_cache.get("pie_graph_role")
+        cached = not_modified(request, response, stats_etag("pie_graph_role"))
+        if cached:
+            return cached
 
         if not role_results:
             raise HTTPException(status_code=404, detail="No role data found")
@@ -439,7 +388,6 @@ def graph_by_role(db=Depends(get_db), current_user=Depends(get_current_active_us
 
     except mysql.connector.Error as e:
         logger.error(f"Database error while fetching graph data: {str(e)}")
-        connection.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error: {str(e)}")
 
     except Exception as e:
@@ -450,13 +398,13 @@ def graph_by_role(db=Depends(get_db), current_user=Depends(get_current_active_us
 
 
 @router.get("/pie_graph_department", response_model=List[Pie_graph_pay_department])
-def get_pie_graph_department(db=Depends(get_db), current_user=Depends(get_current_active_user)):
-    cursor, _ = db
-
+async def get_pie_graph_department(request: Request, response: Response,
+                                   current_user=Depends(get_current_user_detached)):
     try:
-        # Call stored procedure or execute SQL query
-        cursor.callproc('employee_by_department_presentages')
-        department_data = next(cursor.stored_results()).fetchall()
+        department_data = await stats_cache.get("pie_graph_department")
+        cached = not_modified(request, response, stats_etag("pie_graph_department"))
+        if cached:
+            return cached
 
         if not department_data:
             raise HTTPException(status_code=404, detail="No department data found")
@@ -484,4 +432,62 @@ def get_pie_graph_department(db=Depends(get_db), current_user=Depends(get_curren
 
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unexpected error occurred")
\ No newline at end of file
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unexpected error occurred")
+
+
+# Everything the dashboard page needs in one response: one auth resolution, and the
+# seven aggregates are read from the statistics cache concurrently
+@router.get("/dashboard", response_model=Dashboard)
+async def dashboard(request: Request, response: Response, principal=Depends(get_current_principal_detached)):
+    try:
+        if not principal.employee_id:
+            raise HTTPException(status_code=404, detail="User not found")
+
+        (on_leave, full_time, part_time, gender, paygrade, role, department) = await asyncio.gather(
+            stats_cache.get("on_leave"),
+            stats_cache.get("today_full_time"),
+            stats_cache.get("today_half_time"),
+            stats_cache.get("pie_graph_gender"),
+            stats_cache.get("pie_graph_paygrade"),
+            stats_cache.get("pie_graph_role"),
+            stats_cache.get("pie_graph_department"),
+        )
+        cached = not_modified(request, response, stats_etag(*DASHBOARD_STATS))
+        if cached:
+            return cached
+
+        # Encoded the way the standalone endpoints return them (DECIMAL -> number);
+        # a Dict[str, Any] field would serialize Decimal values as strings
+        return Dashboard(
+            on_leave=jsonable_encoder(on_leave),
+            today_full_time=jsonable_encoder(full_time),
+            today_half_time=jsonable_encoder(part_time),
+            pie_graph_gender=[
+                Pie_graph_gender(gender=row["gender"], presentage_by_gender=row["presentage_by_gender"])
+                for row in gender or []
+            ],
+            pie_graph_paygrade=[
+                Pie_graph_pay_grade(pay_grade=row["pay_grade"], presentage_by_pay_grade=row["presentage_by_pay_grade"])
+                for row in paygrade or []
+            ],
+            pie_graph_role=[
+                Pie_graph_role(role=row["job_title"], presentage_by_role=row["presentage_by_role"])
+                for row in role or []
+            ],
+            pie_graph_department=[
+                Pie_graph_pay_department(department_name=row["department_name"],
+                                         presentage_by_department=row["presentage_by_department"])
+                for row in department or []
+            ],
+        )
+
+    except HTTPException:
+        raise
+
+    except mysql.connector.Error as e:
+        logger.error(f"Database error while fetching dashboard data: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error: {str(e)}")
+
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unexpected error occurred")
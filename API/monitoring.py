@@ -0,0 +1,93 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from core.admission import admission_stats
+from core.cache import cache_stats
+from core.events import leave_events
+from core.logs import log_stats
+from core.metrics import render_metrics, route_summary
+from core.ratelimit import rate_limit_stats
+from core.revocation import revocation_list
+from core.security import get_current_principal_detached, hash_stats
+from db.db import pool_stats, replica_stats, statement_stats
+
+router = APIRouter()
+
+
+# Prometheus text exposition of the histograms and counters in core.metrics
+@router.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+# The JSON detail routes show SQL text, call sites, replica hosts and driver errors,
+# so only admins may read them
+async def require_admin(principal=Depends(get_current_principal_detached)):
+    if not principal.is_admin:
+        raise HTTPException(status_code=403, detail="Not authorized to view monitoring details")
+
+
+details = APIRouter(prefix="/metrics", dependencies=[Depends(require_admin)])
+
+
+# Requests, 5xx rate and p50/p95/p99 latency per route
+@details.get("/routes")
+async def route_metrics():
+    return route_summary()
+
+
+# Connection pool usage per role (checked-out connections, waiters, wait times)
+@details.get("/db_pools")
+async def db_pool_metrics():
+    return pool_stats()
+
+
+# Health, lag and read routing of the read replicas
+@details.get("/db_replicas")
+async def db_replica_metrics():
+    return replica_stats()
+
+
+# Prepared statement reuse, plus executes and procedure calls that bypass it
+@details.get("/statements")
+async def statement_metrics():
+    return statement_stats()
+
+
+# Hit/miss counters for the in-process caches
+@details.get("/caches")
+async def cache_metrics():
+    return cache_stats()
+
+
+# Revoked tokens held in memory and bloom filter effectiveness
+@details.get("/revocations")
+async def revocation_metrics():
+    return revocation_list.stats()
+
+
+# Login rate limiting and requests shed by admission control
+@details.get("/load_shedding")
+async def load_shedding_metrics():
+    return {"rate_limits": rate_limit_stats(), "admission": admission_stats()}
+
+
+# In-flight, completed and rejected bcrypt calls
+@details.get("/password_hashing")
+async def password_hashing_metrics():
+    return hash_stats
+
+
+# Queued, dropped, sampled-out and rate-limited log records
+@details.get("/logging")
+async def logging_metrics():
+    return log_stats()
+
+
+# Subscribers and published/dropped counts for the leave event stream
+@details.get("/leave_events")
+async def leave_event_metrics():
+    return leave_events.stats()
+
+
+router.include_router(details)
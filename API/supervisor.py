@@ -3,77 +3,66 @@ from typing import List,Dict
 import mysql.connector
 from fastapi import APIRouter, Depends, HTTPException, status
 from classes.supervisor import SupervisorWithTeam, Leave_Status, TeamMember
-from core.security import get_current_active_user
-from classes.Leavings import LeaveRequestResponse
-from db.db import get_db
-
-# Initialize logging
-logging.basicConfig(level=logging.INFO)
+from core.security import get_role_db, get_current_principal, \
+    get_current_principal_detached
+from classes.Leavings import LeaveRequestResponse, BulkItemResult
+from core.stats import stats_cache
+from db.db import DB_BULK_MAX_ITEMS, request_connection, run_in_batches
+from db.leaves import leave_owners, publish_leave_events
+
+# Logging is configured centrally (core.logs)
 logger = logging.getLogger(__name__)
 router = APIRouter()
 @router.get("/supervisors-with-teams", response_model=List[List[Dict[str, str]]])
-async def supervisors_with_teams(db=Depends(get_db), current_user=Depends(get_current_active_user)):
-    logger.info(f"User {current_user.username} is attempting to fetch all supervisors with teams")
+async def supervisors_with_teams(principal=Depends(get_current_principal_detached)):
+    logger.info("User %s is attempting to fetch all supervisors with teams", principal.username)
 
-    cursor, connection = db
     try:
         # Check if the current user is an admin
-        cursor.execute("SELECT is_admin FROM user_access WHERE username = %s", (current_user.username,))
-        is_admin = cursor.fetchone()
-
-        logger.info(f"Checking admin status for user {current_user.username}: {is_admin}")
-
-        if not is_admin:  # Access the first column of the result tuple
-            logger.warning(f"User {current_user.username} is not authorized to view this information")
+        if not principal.is_admin:
+            logger.warning("User %s is not authorized to view this information", principal.username)
             raise HTTPException(status_code=403, detail="Not authorized to view this information")
 
-        # Fetch all supervisors
-        logger.info("Fetching all supervisors from the database")
-        cursor.execute("""
-        SELECT supervisor.employee_id, employee.first_name, employee.last_name
-        FROM supervisor
-        JOIN employee ON employee.employee_id = supervisor.employee_id;
-        """)
-        supervisors = cursor.fetchall()
-
-        if not supervisors:
-            logger.info("No supervisors found")
-            return []
-
-        all_supervisors_with_teams = []
-
-        # For each supervisor, fetch their team members
-        for supervisor_row in supervisors:
-            supervisor_id = supervisor_row['employee_id']
-            supervisor_name = f"{supervisor_row['first_name']} {supervisor_row['last_name']}"
-
-            logger.info(f"Fetching team members for supervisor {supervisor_name} (ID: {supervisor_id})")
-
-            # Fetch team members for the supervisor
-            cursor.execute("""
-            SELECT  distinct supervisor.employee_id, employee.first_name, employee.last_name, employee.gender
+        # The caller is authenticated first, so only one connection is held at a time
+        async with request_connection(principal.role, read_only=True, session=principal.username) as (cursor, _):
+            # Fetch all supervisors
+            logger.debug("Fetching all supervisors from the database")
+            await cursor.execute("""
+            SELECT supervisor.employee_id, employee.first_name, employee.last_name
+            FROM supervisor
+            JOIN employee ON employee.employee_id = supervisor.employee_id;
+            """)
+            supervisors = await cursor.fetchall()
+
+            if not supervisors:
+                logger.info("No supervisors found")
+                return []
+
+            # Fetch every team in one query and group the members by supervisor
+            await cursor.execute("""
+            SELECT  distinct supervisor.supervisor_id, supervisor.employee_id, employee.first_name, employee.last_name,
+                    employee.gender
             FROM supervisor
             JOIN employee ON supervisor.employee_id = employee.employee_id
-            WHERE supervisor.supervisor_id = %s
-            """, (supervisor_id,))
-            team_members = cursor.fetchall()
-
-            # Format the result as a 2D array
-            supervisor_with_team = [
-                {"employee_id": supervisor_id, "name": supervisor_name}
-            ] + [
-                {
+            """)
+            teams = {}
+            for member in await cursor.fetchall():
+                teams.setdefault(member['supervisor_id'], []).append({
                     "employee_id": member['employee_id'],
                     "first_name": member['first_name'],
                     "last_name": member['last_name'],
                     "gender": member['gender']
-                }
-                for member in team_members
-            ]
+                })
 
-            all_supervisors_with_teams.append(supervisor_with_team)
+        # Format the result as a 2D array
+        all_supervisors_with_teams = [
+            [{"employee_id": supervisor_row['employee_id'],
+              "name": f"{supervisor_row['first_name']} {supervisor_row['last_name']}"}]
+            + teams.get(supervisor_row['employee_id'], [])
+            for supervisor_row in supervisors
+        ]
 
-        logger.info(f"Successfully fetched teams for {len(supervisors)} supervisors")
+        logger.info("Successfully fetched teams for %d supervisors", len(supervisors))
 
         return all_supervisors_with_teams
 
@@ -88,28 +77,27 @@ async def supervisors_with_teams(db=Depends(get_db), current_user=Depends(get_cu
 
 
 @router.put("/leavings/status")
-async def leave_status(status: Leave_Status, db=Depends(get_db), current_user=Depends(get_current_active_user)):
+async def leave_status(status: Leave_Status, db=Depends(get_role_db), principal=Depends(get_current_principal)):
     cursor, connection = db
     try:
-        # Check admin status using a stored procedure
-        cursor.execute("SELECT is_admin FROM user_access WHERE username = %s", (current_user.username,))
-        is_admin = cursor.fetchone()
-
         # Check visibility access (whether the user is an admin)
-        if not is_admin or not is_admin['is_admin']:
+        if not principal.is_admin:
             raise HTTPException(status_code=403, detail="Not authorized to update leave status.")
 
         # Ensure status fields are provided
         if not status.leave_request_id or not status.status_:
             raise HTTPException(status_code=400, detail="Missing leave_request_id or status.")
 
-        cursor.callproc('evaluate_leave_request', [status.leave_request_id,status.status_],)
+        await cursor.callproc('evaluate_leave_request', [status.leave_request_id,status.status_],)
+        owners = await leave_owners(cursor, [status.leave_request_id])
         # supervisor_result = next(cursor.stored_results()).fetchone()
         #
         # if not supervisor_result:
         #     raise HTTPException(status_code=404, detail="Supervisor ID not found.")
 
-        connection.commit()
+        await connection.commit()
+        stats_cache.invalidate("leaves")
+        publish_leave_events("status", owners, request_status=status.status_)
 
         return {"message": "Leave request status updated successfully."}
 
@@ -122,4 +110,41 @@ async def leave_status(status: Leave_Status, db=Depends(get_db), current_user=De
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Unexpected error: {str(e)}")
 
 
+def _evaluate_leave(cursor, leave):
+    cursor.callproc('evaluate_leave_request', [leave.leave_request_id, leave.status_])
+
+
+# Approve or reject many leave requests at once; each item reports its own outcome
+@router.put("/leavings/status/bulk", response_model=List[BulkItemResult])
+async def leave_status_bulk(statuses: List[Leave_Status], db=Depends(get_role_db),
+                            principal=Depends(get_current_principal)):
+    if not principal.is_admin:
+        raise HTTPException(status_code=403, detail="Not authorized to update leave status.")
 
+    if len(statuses) > DB_BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {DB_BULK_MAX_ITEMS} leave statuses per call")
+
+    results = [None] * len(statuses)
+    valid = []
+    for index, leave in enumerate(statuses):
+        if not leave.leave_request_id or not leave.status_:
+            results[index] = BulkItemResult(index=index, success=False, error="Missing leave_request_id or status.")
+        else:
+            valid.append(index)
+
+    try:
+        owners = await leave_owners(db[0], list({statuses[i].leave_request_id for i in valid}))
+        errors = await run_in_batches(db, [statuses[i] for i in valid], _evaluate_leave)
+    except mysql.connector.Error as e:
+        logger.error(f"Database error while setting leave statuses: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+    for index, error in zip(valid, errors):
+        results[index] = BulkItemResult(index=index, success=error is None, error=error)
+        leave = statuses[index]
+        if error is None and leave.leave_request_id in owners:
+            publish_leave_events("status", {leave.leave_request_id: owners[leave.leave_request_id]},
+                                 request_status=leave.status_)
+
+    stats_cache.invalidate("leaves")
+    return results
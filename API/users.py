@@ -1,10 +1,17 @@
 
+from typing import Optional
+
+import jwt
 import mysql.connector
-from fastapi import APIRouter, Depends, HTTPException, status,Body
-from classes.User import User, UserLogin, LoginResponse,UpdatePassword
+from fastapi import APIRouter, Depends, HTTPException, status,Body, Request
+from classes.User import User, UserLogin, LoginResponse,UpdatePassword, RefreshRequest
 from core.middleware import logger
-from core.security import pwd_context, verify_password, create_access_token, get_current_active_user
-from db.db import get_db
+from core.security import get_password_hash_async, verify_password_async, create_access_token, get_current_active_user, get_role_db, invalidate_user, \
+    create_refresh_token, decode_refresh_token, get_user, credentials_exception, decode_token, oauth2_scheme
+from core.ratelimit import check_login_rate
+from core.revocation import revocation_list
+from core.versions import resource_versions
+from db.db import get_db, request_connection
 
 
 
@@ -16,15 +23,17 @@ async def create_user(user: User, db=Depends(get_db)):
     cursor, connection = db
     try:
         # Hash the password
-        hashed_password = pwd_context.hash(user.password)
+        hashed_password = await get_password_hash_async(user.password)
 
         # Call stored procedure to create user account based on access level
-        cursor.callproc("create_user_account", [user.username, hashed_password, user.employee_id, user.access_level])
-        connection.commit()
+        await cursor.callproc("create_user_account", [user.username, hashed_password, user.employee_id, user.access_level])
+        await connection.commit()
+        invalidate_user(user.username)
+        resource_versions.bump("users")
 
         # Fetch the newly created user record to confirm
-        cursor.execute("SELECT * FROM users WHERE username = %s", (user.username,))
-        new_user = cursor.fetchone()
+        await cursor.execute("SELECT * FROM users WHERE username = %s", (user.username,))
+        new_user = await cursor.fetchone()
 
         if not new_user:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found after insertion")
@@ -32,8 +41,11 @@ async def create_user(user: User, db=Depends(get_db)):
         logger.info(f"User {user.username} registered successfully.")
         return {"message": "User registered successfully", "user": new_user}
 
+    except HTTPException:
+        raise
+
     except mysql.connector.Error as e:
-        connection.rollback()  # Rollback transaction on error
+        await connection.rollback()  # Rollback transaction on error
         logger.error(f"Database error during user registration: {str(e)}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error: {str(e)}")
 
@@ -43,56 +55,46 @@ async def create_user(user: User, db=Depends(get_db)):
 
 
 # Endpoint to log in a user and generate an access token
+# Attempts are rate limited per client address and per username before a
+# connection is borrowed (core.ratelimit). No connection is held while bcrypt
+# runs, since it may queue for a hash worker.
 @router.post("/login", response_model=LoginResponse)
-async def login_user(user: UserLogin, db=Depends(get_db), ):
-    cursor, connection = db
+async def login_user(user: UserLogin, request: Request):
+    await check_login_rate(request, user.username)
 
     try:
-        # Fetch the user record by username
-        cursor.execute("SELECT * FROM users WHERE username = %s", (user.username,))
-        db_user = cursor.fetchone()
+        async with request_connection() as (cursor, _):
+            # Fetch the user record by username
+            await cursor.execute("SELECT * FROM users WHERE username = %s", (user.username,))
+            db_user = await cursor.fetchone()
 
         if not db_user:
-            logger.warning(f"Login failed for username {user.username}: User not found")
+            logger.warning("Login failed for username %s: User not found", user.username)
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Invalid credentials")
 
         # Check if the password is valid
-        if not verify_password(user.password, db_user['password']):
-            logger.warning(f"Login failed for username {user.username}: Invalid password")
+        if not await verify_password_async(user.password, db_user['password']):
+            logger.warning("Login failed for username %s: Invalid password", user.username)
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Invalid credentials")
-        role = None
-        # Call the stored procedure 'role_checker' to get the user role
-        logger.info(f"Calling 'role_checker' procedure for user {user.username}")
-        cursor.callproc('role_checker', [user.username])
-
-        # Fetch the result from the procedure
-        result_cursor = next(cursor.stored_results(), None)
 
-        if result_cursor is None:
-            logger.error(f"No result set returned from stored procedure 'role_checker'")
-            raise HTTPException(status_code=500, detail="Error determining user role")
-#
-        role_row = result_cursor.fetchone()
-        if role_row is None :
-            logger.error(f"No role returned for username {user.username}")
-            raise HTTPException(status_code=500, detail="Error determining user role")
+        async with request_connection() as (cursor, connection):
+            role = await user_role(cursor, user.username)
 
-        role = role_row['user_role']  # The role should be in the first column of the row
+            # Update the last login time using a procedure (if applicable)
+            logger.debug("Updating last login for user %s", user.username)
+            await cursor.callproc("login_update", [user.username])
+            await connection.commit()
 
-        # Log the role for debugging
-        logger.info(f"User {user.username} has role: {role}")
-
-        # Update the last login time using a procedure (if applicable)
-        logger.info(f"Updating last login for user {user.username}")
-        cursor.callproc("login_update", [user.username])
-        connection.commit()
-
-        # Generate an access token
-        access_token = create_access_token(data={"sub": db_user['username']})
-        logger.info(f"User {user.username} logged in successfully")
+        # Generate an access token; the role claim selects the DB pool for later requests
+        access_token = create_access_token(data={"sub": db_user['username'], "role": role})
+        logger.info("User %s logged in successfully", user.username, extra={"username": user.username, "role": role})
 
         # Return the login response with username, token, and role
-        return LoginResponse(username=db_user['username'], token=access_token, role=role)
+        return LoginResponse(username=db_user['username'], token=access_token, role=role,
+                             refresh_token=create_refresh_token(db_user['username']))
+
+    except HTTPException:
+        raise
 
     except mysql.connector.Error as e:
         logger.error(f"Database error during login: {str(e)}")
@@ -104,27 +106,106 @@ async def login_user(user: UserLogin, db=Depends(get_db), ):
 
 
 
+# Role name from the 'role_checker' procedure; it becomes the token's role claim
+async def user_role(cursor, username):
+    logger.debug("Calling 'role_checker' procedure for user %s", username)
+    await cursor.callproc('role_checker', [username])
+
+    # Fetch the result from the procedure
+    result_cursor = next(cursor.stored_results(), None)
+
+    if result_cursor is None:
+        logger.error(f"No result set returned from stored procedure 'role_checker'")
+        raise HTTPException(status_code=500, detail="Error determining user role")
+
+    role_row = result_cursor.fetchone()
+    if role_row is None:
+        logger.error("No role returned for username %s", username)
+        raise HTTPException(status_code=500, detail="Error determining user role")
+
+    role = role_row['user_role']  # The role should be in the first column of the row
+    logger.debug("User %s has role: %s", username, role)
+    return role
+
+
+# Exchange a refresh token for a new access token and refresh token. The user and
+# their role are read again, so disabled accounts and role changes take effect at
+# the next refresh rather than at the end of a long-lived token. Refresh tokens are
+# single use: the one presented is revoked.
+@router.post("/login/refresh", response_model=LoginResponse)
+async def refresh_login(refresh: RefreshRequest, db=Depends(get_db)):
+    cursor, connection = db
+    claims = decode_refresh_token(refresh.refresh_token)
+    username = claims["sub"]
+
+    try:
+        db_user = await get_user(cursor, username)
+        if db_user is None or db_user.disabled:
+            raise credentials_exception
+
+        role = await user_role(cursor, username)
+        # Only the request whose revocation actually inserted the row may use the
+        # token; concurrent or replayed refreshes (from any process) are refused
+        if not await revocation_list.revoke(cursor, connection, claims["jti"], claims["exp"]):
+            raise credentials_exception
+        access_token = create_access_token(data={"sub": username, "role": role})
+        return LoginResponse(username=username, token=access_token, role=role,
+                             refresh_token=create_refresh_token(username))
+
+    except HTTPException:
+        raise
+
+    except mysql.connector.Error as e:
+        logger.error(f"Database error during token refresh: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error: {str(e)}")
+
+
+# Revoke the caller's access token, and their refresh token when one is sent
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(refresh: Optional[RefreshRequest] = None, token: str = Depends(oauth2_scheme),
+                 db=Depends(get_role_db)):
+    cursor, connection = db
+    try:
+        claims = decode_token(token)
+    except jwt.PyJWTError:
+        raise credentials_exception
+
+    try:
+        await revocation_list.revoke(cursor, connection, claims["jti"], claims["exp"])
+        if refresh is not None:
+            refresh_claims = decode_refresh_token(refresh.refresh_token)
+            if refresh_claims["sub"] != claims["sub"]:
+                raise credentials_exception
+            await revocation_list.revoke(cursor, connection, refresh_claims["jti"], refresh_claims["exp"])
+        logger.info("User %s logged out", claims["sub"])
+
+    except mysql.connector.Error as e:
+        logger.error(f"Database error during logout: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error: {str(e)}")
+
+
 @router.put("/user/{username}", status_code=status.HTTP_200_OK)
 async def update_user_password(
         username: str,
         password_: UpdatePassword = Body(...),  # Use Body to specify the request body
-        db=Depends(get_db),
+        db=Depends(get_role_db),
         current_user=Depends(get_current_active_user)
 ):
     cursor, connection = db
     try:
 
-        cursor.execute(
+        await cursor.execute(
             "UPDATE users SET password = %s WHERE username = %s",
             (password_.password, username)  # Assuming 'user_id' is the correct key
         )
-        connection.commit()
+        await connection.commit()
+        invalidate_user(username)
 
         logger.info(f"Access updated for user {username}")
         return {"message": "User access updated successfully"}
 
     except mysql.connector.Error as e:
-        connection.rollback()
+        await connection.rollback()
         logger.error(f"Database error updating access for user {username}: {str(e)}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error: {str(e)}")
 
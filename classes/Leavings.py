@@ -42,3 +42,9 @@ class LeaveRequestResponse(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+class BulkItemResult(BaseModel):
+    index: int
+    success: bool
+    error: Optional[str] = None
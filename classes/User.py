@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseModel
 
 class User(BaseModel):
@@ -21,6 +23,7 @@ class LoginResponse(BaseModel):
     username: str
     token: str
     role:str
+    refresh_token: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -35,6 +38,12 @@ class UserResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+
 class UpdatePassword(BaseModel):
     password: str
     class Config:
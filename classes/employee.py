@@ -1,5 +1,5 @@
 import datetime as d
-from typing import Optional
+from typing import Optional, Dict, Any, List
 from decimal import Decimal
 from pydantic import BaseModel
 
@@ -90,4 +90,29 @@ class Pie_graph_pay_department(BaseModel):
     presentage_by_department: Decimal
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+class Dashboard(BaseModel):
+    on_leave: Optional[Dict[str, Any]] = None
+    today_full_time: Optional[Dict[str, Any]] = None
+    today_half_time: Optional[Dict[str, Any]] = None
+    pie_graph_gender: List[Pie_graph_gender] = []
+    pie_graph_paygrade: List[Pie_graph_pay_grade] = []
+    pie_graph_role: List[Pie_graph_role] = []
+    pie_graph_department: List[Pie_graph_pay_department] = []
+
+    class Config:
+        from_attributes = True
+
+
+class EmployeeImportError(BaseModel):
+    row: int
+    errors: List[str]
+
+
+class EmployeeImportReport(BaseModel):
+    total: int = 0
+    imported: int = 0
+    failed: int = 0
+    errors: List[EmployeeImportError] = []
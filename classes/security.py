@@ -7,6 +7,7 @@ from pydantic import BaseModel
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
 
 
 class TokenData(BaseModel):
@@ -33,3 +34,12 @@ class UserInDB(BaseModel):
 
     class Config:
         from_attributes = True  # Add hashed_password field to store the hashed password in DB
+
+
+# Identity and privileges of the caller, resolved once and shared by all routers
+class Principal(BaseModel):
+    username: str
+    employee_id: Optional[str] = None
+    is_admin: bool = False
+    is_supervisor: bool = False
+    role: str = "employee"
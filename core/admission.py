@@ -0,0 +1,55 @@
+import os
+
+from starlette.responses import JSONResponse
+
+from core.metrics import Counter, http_in_flight
+from db.db import pool_waiters
+
+# Admission control: while more than ADMISSION_MAX_POOL_WAITERS requests are
+# queued for a database connection (or, when set, more than ADMISSION_MAX_IN_FLIGHT
+# requests are being handled) new requests are answered 503 at once instead of
+# joining the queue and timing out after DB_POOL_TIMEOUT. Monitoring endpoints stay
+# reachable so the overload can be observed.
+ADMISSION_MAX_POOL_WAITERS = int(os.getenv("ADMISSION_MAX_POOL_WAITERS", 50))
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", 0))
+ADMISSION_EXEMPT_PATHS = tuple(path.strip() for path in os.getenv("ADMISSION_EXEMPT_PATHS", "/metrics").split(",")
+                               if path.strip())
+
+shed_requests = Counter("http_requests_shed_total", "Requests refused by admission control", ("reason",))
+
+
+def _overloaded():
+    if ADMISSION_MAX_POOL_WAITERS and pool_waiters() > ADMISSION_MAX_POOL_WAITERS:
+        return "pool_waiters"
+    if ADMISSION_MAX_IN_FLIGHT and http_in_flight.series().get((), 0) > ADMISSION_MAX_IN_FLIGHT:
+        return "in_flight"
+    return None
+
+
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(ADMISSION_EXEMPT_PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        reason = _overloaded()
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+
+        shed_requests.inc(reason)
+        response = JSONResponse({"detail": "Server busy, please retry"}, status_code=503,
+                                headers={"Retry-After": "1"})
+        await response(scope, receive, send)
+
+
+def admission_stats():
+    return {
+        "max_pool_waiters": ADMISSION_MAX_POOL_WAITERS,
+        "max_in_flight": ADMISSION_MAX_IN_FLIGHT,
+        "pool_waiters": pool_waiters(),
+        "shed": {reason: count for (reason,), count in shed_requests.series().items()},
+    }
@@ -0,0 +1,157 @@
+import os
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", 4))
+# Server-sent events are left out on purpose: buffering up to the size threshold
+# would hold back the first events and heartbeats
+COMPRESSION_TYPES = tuple(os.getenv(
+    "COMPRESSION_TYPES", "application/json,application/x-ndjson,text/plain,text/html,text/csv").split(","))
+
+
+class _GzipEncoder:
+    name = "gzip"
+
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    # Flush after every chunk so a streamed response reaches the client as it is produced
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliEncoder:
+    name = "br"
+
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+# Pick brotli when the client accepts it and the package is installed, else gzip
+def _choose_encoder(accept_encoding):
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.partition(";")
+        name, _, value = params.partition("=")
+        try:
+            if name.strip() == "q" and float(value) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(coding.strip())
+
+    if brotli is not None and "br" in accepted:
+        return _BrotliEncoder
+    if "gzip" in accepted:
+        return _GzipEncoder
+    return None
+
+
+# Pure ASGI middleware compressing responses of an allowed content type once they
+# reach `minimum_size` bytes. Streaming responses are buffered only up to the
+# threshold and then compressed chunk by chunk, so NDJSON exports stay streamed.
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_SIZE, content_types=COMPRESSION_TYPES):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.content_types = tuple(content_type.strip() for content_type in content_types if content_type.strip())
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoder_class = _choose_encoder(Headers(scope=scope).get("accept-encoding", ""))
+        if encoder_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressingResponder(send, encoder_class, self.minimum_size, self.content_types)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressingResponder:
+    def __init__(self, send, encoder_class, minimum_size, content_types):
+        self._send = send
+        self._encoder_class = encoder_class
+        self._minimum_size = minimum_size
+        self._content_types = content_types
+
+        self._start = None
+        self._buffer = []
+        self._buffered = 0
+        self._encoder = None
+        self._passthrough = False
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            content_type = headers.get("content-type", "").split(";")[0].strip()
+            self._passthrough = "content-encoding" in headers or content_type not in self._content_types
+            if self._passthrough:
+                await self._send(message)
+            else:
+                self._start = message
+            return
+
+        if self._passthrough or message["type"] != "http.response.body":
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self._encoder is not None:
+            chunk = self._encoder.compress(body)
+            if not more_body:
+                chunk += self._encoder.finish()
+            await self._send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+            return
+
+        self._buffer.append(body)
+        self._buffered += len(body)
+        if self._buffered < self._minimum_size:
+            if more_body:
+                return
+            # The whole response is below the threshold: send it as it is
+            await self._flush_uncompressed()
+            return
+
+        self._encoder = self._encoder_class()
+        headers = MutableHeaders(raw=self._start["headers"])
+        headers["Content-Encoding"] = self._encoder.name
+        headers.add_vary_header("Accept-Encoding")
+
+        data = b"".join(self._buffer)
+        self._buffer = []
+        chunk = self._encoder.compress(data)
+        if more_body:
+            del headers["Content-Length"]
+        else:
+            chunk += self._encoder.finish()
+            headers["Content-Length"] = str(len(chunk))
+
+        await self._send(self._start)
+        await self._send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+    async def _flush_uncompressed(self):
+        MutableHeaders(raw=self._start["headers"]).add_vary_header("Accept-Encoding")
+        await self._send(self._start)
+        await self._send({"type": "http.response.body", "body": b"".join(self._buffer), "more_body": False})
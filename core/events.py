@@ -0,0 +1,62 @@
+import asyncio
+import itertools
+import os
+from contextlib import contextmanager
+
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", 100))
+
+# Subscribers to this topic receive every event (used for admins)
+ALL = "*"
+
+
+# In-process publish/subscribe bus. Publishing never blocks a request: each
+# subscriber has a bounded queue and a subscriber that falls behind loses its
+# oldest events rather than slowing the writer down.
+class EventBus:
+    def __init__(self, queue_size=EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._ids = itertools.count(1)
+
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    @contextmanager
+    def subscribe(self, topic):
+        queue = asyncio.Queue(self.queue_size)
+        self._subscribers.setdefault(topic, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            subscribers = self._subscribers.get(topic)
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[topic]
+
+    def publish(self, topics, event):
+        event = dict(event, id=next(self._ids))
+        self.published += 1
+
+        queues = set()
+        for topic in (*topics, ALL):
+            queues.update(self._subscribers.get(topic, ()))
+
+        for queue in queues:
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(event)
+            self.delivered += 1
+
+    def stats(self):
+        return {
+            "topics": len(self._subscribers),
+            "subscribers": sum(len(queues) for queues in self._subscribers.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+leave_events = EventBus()
@@ -0,0 +1,51 @@
+import asyncio
+from datetime import datetime, timezone
+
+from core.middleware import logger
+
+
+# Latest result of a background job. Readers get it instantly; long-polling readers
+# can wait for the next publish instead of re-running the query themselves.
+class PublishedValue:
+    def __init__(self):
+        self.value = None
+        self.version = 0
+        self.updated_at = None
+        self._changed = asyncio.Event()
+
+    def publish(self, value):
+        if self.version and value == self.value:
+            self.updated_at = datetime.now(timezone.utc)
+            return False
+
+        self.value = value
+        self.version += 1
+        self.updated_at = datetime.now(timezone.utc)
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+        return True
+
+    # Return once the version differs from `since`, or after `timeout` seconds
+    async def wait_for_change(self, since, timeout):
+        if self.version != since:
+            return True
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+async def _run_periodically(interval, job):
+    while True:
+        try:
+            await job()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Background job {job.__name__} failed: {str(e)}")
+        await asyncio.sleep(interval)
+
+
+def start_periodic(interval, job):
+    return asyncio.create_task(_run_periodically(interval, job))
@@ -0,0 +1,161 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" for one JSON object per line, "text" for the classic LEVEL:logger:message
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# Fraction of INFO/DEBUG records kept per logger (and its children),
+# e.g. "API.supervisor=0.1,core.middleware=0.5"
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+# Maximum INFO/DEBUG records per second per logger, 0 for no limit
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", 0))
+
+# Attributes every LogRecord has; anything else was passed through `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def _parse_rates(spec):
+    rates = {}
+    for item in spec.split(","):
+        name, _, rate = item.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+# Drops a share of INFO/DEBUG records per logger and caps how many a logger can
+# emit per second. Warnings and errors always pass.
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates, rate_limit):
+        super().__init__()
+        self.rates = rates
+        self.rate_limit = rate_limit
+        self._resolved = {}
+        self._windows = {}
+
+        self.sampled_out = 0
+        self.rate_limited = 0
+
+    # The rate configured for the logger or its closest configured parent
+    def _rate(self, name):
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate = 1.0
+            parts = name.split(".")
+            for i in range(len(parts), 0, -1):
+                prefix = ".".join(parts[:i])
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+
+        rate = self._rate(record.name)
+        if rate < 1.0 and random.random() >= rate:
+            self.sampled_out += 1
+            return False
+
+        if self.rate_limit:
+            second = int(record.created)
+            window = self._windows.get(record.name)
+            if window is None or window[0] != second:
+                window = self._windows[record.name] = [second, 0]
+            if window[1] >= self.rate_limit:
+                self.rate_limited += 1
+                return False
+            window[1] += 1
+        return True
+
+
+# Hands records to the listener thread without ever blocking the caller: when the
+# queue is full the record is dropped and counted
+class NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    # The stock handler formats the message here, on the request's thread; leave
+    # it to the listener thread instead
+    def prepare(self, record):
+        return record
+
+
+_handler = None
+_listener = None
+sampling_filter = SamplingFilter(_parse_rates(LOG_SAMPLE_RATES), LOG_RATE_LIMIT)
+
+
+# Route every logger through one queue and write records from a background thread.
+# Called once at startup (main.py, CLIs); safe to call again.
+def configure_logging():
+    global _handler, _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+
+    _handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _handler.addFilter(sampling_filter)
+
+    root = logging.getLogger()
+    root.handlers = [_handler]
+    root.setLevel(LOG_LEVEL)
+
+    _listener = QueueListener(_handler.queue, output)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+# Flush whatever is still queued
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def log_stats():
+    return {
+        "queued": _handler.queue.qsize() if _handler else 0,
+        "dropped": _handler.dropped if _handler else 0,
+        "sampled_out": sampling_filter.sampled_out,
+        "rate_limited": sampling_filter.rate_limited,
+    }
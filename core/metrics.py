@@ -0,0 +1,192 @@
+import bisect
+import time
+from contextvars import ContextVar
+
+# Minimal Prometheus text-format metrics. Every metric registers itself here and
+# is rendered by the /metrics endpoint (API/monitoring.py). Metrics are only
+# updated from the event loop, so no locking is needed.
+registry = []
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def series(self):
+        return dict(self._values)
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        self._values[labels] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._values = {}
+        registry.append(self)
+
+    def observe(self, value, *labels):
+        entry = self._values.get(labels)
+        if entry is None:
+            # Per-bucket counts (the last slot is +Inf), sum, count
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    # Estimate the q-quantile from the buckets, interpolating linearly inside the
+    # bucket like Prometheus' histogram_quantile()
+    def quantile(self, q, *labels):
+        entry = self._values.get(labels)
+        if entry is None or not entry[2]:
+            return None
+        counts, _, count = entry
+        rank = q * count
+        cumulative = 0
+        lower = 0.0
+        for bound, bucket_count in zip(self.buckets, counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                return lower + (bound - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+            lower = bound
+        return self.buckets[-1]
+
+    def series(self):
+        return {labels: entry[2] for labels, entry in self._values.items()}
+
+    def samples(self):
+        for labels, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, (('le', bound),))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {count}"
+
+
+def render_metrics():
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+# The ASGI scope of the request being handled, so code deep in the call stack (the
+# DB layer) can label its metrics with the matched route
+request_scope = ContextVar("request_scope", default=None)
+
+
+# Route template ("/leave/request/{leave_request_id}") once the router has matched;
+# raw paths are never used as labels so unknown URLs cannot blow up the series
+def _route_label(scope):
+    route = scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+def endpoint_label():
+    scope = request_scope.get()
+    if scope is None:
+        return "background"
+    return _route_label(scope)
+
+
+http_request_seconds = Histogram("http_request_duration_seconds", "HTTP request latency, including streamed bodies",
+                                 ("method", "route"))
+http_requests = Counter("http_requests_total", "HTTP responses by status code", ("method", "route", "status"))
+http_exceptions = Counter("http_request_exceptions_total", "Requests that raised instead of responding",
+                          ("method", "route"))
+http_in_flight = Gauge("http_requests_in_flight", "Requests currently being handled")
+
+
+# Times every HTTP request and counts it per route template and status code. Label
+# tuples reuse the method and route strings the server and router already hold,
+# so nothing is formatted per request; rendering happens when /metrics is scraped.
+# Also records the scope for endpoint_label().
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        token = request_scope.set(scope)
+        http_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        except BaseException:
+            http_exceptions.inc(scope["method"], _route_label(scope))
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            http_in_flight.dec()
+            route = _route_label(scope)
+            http_request_seconds.observe(elapsed, scope["method"], route)
+            http_requests.inc(scope["method"], route, status_code)
+            request_scope.reset(token)
+
+
+# Request count, error rate and latency percentiles per route, for humans
+def route_summary():
+    errors = {}
+    for (method, route, status_code), count in http_requests.series().items():
+        if status_code >= 500:
+            errors[(method, route)] = errors.get((method, route), 0) + count
+
+    summary = {}
+    for (method, route), count in http_request_seconds.series().items():
+        summary[f"{method} {route}"] = {
+            "requests": count,
+            "error_rate": round(errors.get((method, route), 0) / count, 4),
+            **{name: round(http_request_seconds.quantile(q, method, route), 6)
+               for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        }
+    return summary
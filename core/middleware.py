@@ -1,5 +1,5 @@
-# Initialize logging
+# Shared application logger; handlers, format and sampling are set up once by
+# core.logs.configure_logging()
 import logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -0,0 +1,190 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+
+from anyio import to_thread
+from fastapi import HTTPException, status
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Profile photos live in a content-addressed store on disk: a photo is saved as
+# <PHOTO_DIR>/<first two hex digits>/<sha256><ext> and the employee row only keeps
+# "<sha256><ext>" in profile_photo. Identical uploads are stored once, and a
+# stored file never changes, so it can be cached by clients indefinitely.
+PHOTO_DIR = os.getenv("PHOTO_DIR", os.path.join("media", "photos"))
+PHOTO_MAX_BYTES = int(os.getenv("PHOTO_MAX_BYTES", 10 * 1024 * 1024))
+PHOTO_CHUNK_SIZE = 1024 * 1024
+# Thumbnail edge lengths clients may ask for; anything else would let them fill the disk
+PHOTO_THUMB_SIZES = tuple(int(size) for size in os.getenv("PHOTO_THUMB_SIZES", "64,128,256").split(","))
+
+# File signature -> (extension, media type)
+_SIGNATURES = (
+    (b"\xff\xd8\xff", ".jpg", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", ".png", "image/png"),
+    (b"RIFF", ".webp", "image/webp"),
+)
+MEDIA_TYPES = {extension: media_type for _, extension, media_type in _SIGNATURES}
+_REFERENCE = re.compile(r"^[0-9a-f]{64}\.(jpg|png|webp)$")
+
+_thumbnail_tasks = {}
+
+
+def _sniff(head):
+    for signature, extension, _ in _SIGNATURES:
+        if head.startswith(signature):
+            if extension == ".webp" and head[8:12] != b"WEBP":
+                continue
+            return extension
+    return None
+
+
+def is_reference(value):
+    return bool(value) and _REFERENCE.match(value) is not None
+
+
+def photo_path(reference):
+    if not is_reference(reference):
+        raise HTTPException(status_code=404, detail="Photo not found")
+    return os.path.join(PHOTO_DIR, reference[:2], reference)
+
+
+def media_type(reference):
+    return MEDIA_TYPES[os.path.splitext(reference)[1]]
+
+
+# Move a fully written temporary file to its content address
+def _commit(tmp_path, digest, extension):
+    reference = digest + extension
+    target = photo_path(reference)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.exists(target):
+        os.unlink(tmp_path)
+    else:
+        os.replace(tmp_path, target)
+    return reference
+
+
+def _open_tmp():
+    os.makedirs(PHOTO_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=PHOTO_DIR, suffix=".part")
+    return os.fdopen(fd, "wb"), tmp_path
+
+
+def _discard(tmp_file, tmp_path):
+    tmp_file.close()
+    if os.path.exists(tmp_path):
+        os.unlink(tmp_path)
+
+
+# Stream an UploadFile into the store chunk by chunk, so memory use stays at one
+# chunk whatever the photo size. Returns the reference to save on the employee.
+async def save_upload(upload):
+    tmp_file, tmp_path = await to_thread.run_sync(_open_tmp)
+    digest = hashlib.sha256()
+    size = 0
+    extension = None
+    try:
+        while chunk := await upload.read(PHOTO_CHUNK_SIZE):
+            if extension is None:
+                extension = _sniff(chunk[:16])
+                if extension is None:
+                    raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                                        detail="Upload a JPEG, PNG or WebP image")
+            size += len(chunk)
+            if size > PHOTO_MAX_BYTES:
+                raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                    detail=f"Photos are limited to {PHOTO_MAX_BYTES} bytes")
+            digest.update(chunk)
+            await to_thread.run_sync(tmp_file.write, chunk)
+
+        if extension is None:
+            raise HTTPException(status_code=400, detail="Empty upload")
+        await to_thread.run_sync(tmp_file.close)
+        return await to_thread.run_sync(_commit, tmp_path, digest.hexdigest(), extension)
+    except BaseException:
+        await to_thread.run_sync(_discard, tmp_file, tmp_path)
+        raise
+
+
+# Photos still sent inline (base64, optionally as a data: URL) in employee
+# payloads are decoded and checked here, returning (reference, image bytes);
+# references and empty values pass through without bytes. Nothing is written yet:
+# callers insert the row first and then store_photo, so a failed insert leaves no
+# file behind.
+def decode_inline(value):
+    if not value or is_reference(value):
+        return value or None, None
+
+    try:
+        data = base64.b64decode(value.split(",", 1)[1] if value.startswith("data:") else value, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError("profile_photo must be a photo reference or a base64 encoded image")
+    if len(data) > PHOTO_MAX_BYTES:
+        raise ValueError(f"Photos are limited to {PHOTO_MAX_BYTES} bytes")
+    extension = _sniff(data[:16])
+    if extension is None:
+        raise ValueError("profile_photo must be a JPEG, PNG or WebP image")
+    return hashlib.sha256(data).hexdigest() + extension, data
+
+
+# Write photo bytes from decode_inline under their reference
+def store_photo(reference, data):
+    if os.path.exists(photo_path(reference)):
+        return
+    tmp_file, tmp_path = _open_tmp()
+    try:
+        tmp_file.write(data)
+        tmp_file.close()
+        _commit(tmp_path, *os.path.splitext(reference))
+    except BaseException:
+        _discard(tmp_file, tmp_path)
+        raise
+
+
+def _thumbnail_path(reference, size):
+    return os.path.join(PHOTO_DIR, "thumbs", str(size), reference[:2], reference)
+
+
+def _render_thumbnail(source, target, size):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file, Image.open(source) as image:
+            image.thumbnail((size, size))
+            image.save(tmp_file, format=image.format)
+        os.replace(tmp_path, target)
+    finally:
+        # Only left over when rendering failed
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+# Path of the `size` thumbnail, generated on first request and cached on disk.
+# Without Pillow installed the original photo is served instead.
+async def thumbnail_path(reference, size):
+    if size not in PHOTO_THUMB_SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of {', '.join(map(str, PHOTO_THUMB_SIZES))}")
+    source = photo_path(reference)
+    if Image is None or not os.path.exists(source):
+        return source
+
+    target = _thumbnail_path(reference, size)
+    if os.path.exists(target):
+        return target
+
+    # Concurrent requests for the same thumbnail share one render
+    key = (reference, size)
+    task = _thumbnail_tasks.get(key)
+    if task is None:
+        task = asyncio.ensure_future(to_thread.run_sync(_render_thumbnail, source, target, size))
+        _thumbnail_tasks[key] = task
+        task.add_done_callback(lambda _: _thumbnail_tasks.pop(key, None))
+    await asyncio.shield(task)
+    return target
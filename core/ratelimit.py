@@ -0,0 +1,111 @@
+import importlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException, status
+
+from core.metrics import Counter
+
+# Token buckets for the login endpoints, so credential stuffing or a reconnect
+# storm is turned away before it reaches the database and bcrypt. Each bucket
+# holds `burst` tokens and refills at `rate` tokens per second; an attempt takes
+# one token. Buckets live in RATE_LIMIT_BACKEND: the in-process MemoryBackend by
+# default, or "module:attribute" naming an object with the same async take() that
+# shares buckets between processes (e.g. one backed by Redis).
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100000))
+# Take the client address from X-Forwarded-For; only behind a trusted proxy
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() in ("1", "true", "yes")
+# Login attempts per minute and burst size, per client address and per username
+LOGIN_RATE_PER_IP = float(os.getenv("LOGIN_RATE_PER_IP", 30))
+LOGIN_BURST_PER_IP = int(os.getenv("LOGIN_BURST_PER_IP", 10))
+LOGIN_RATE_PER_USER = float(os.getenv("LOGIN_RATE_PER_USER", 5))
+LOGIN_BURST_PER_USER = int(os.getenv("LOGIN_BURST_PER_USER", 5))
+
+rate_limited = Counter("rate_limited_requests_total", "Requests refused by a rate limiter", ("limiter",))
+
+
+class MemoryBackend:
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        # key -> [tokens, last refill]; least recently used keys are evicted first,
+        # which at worst hands an idle client a fresh bucket
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Returns 0 when a token was taken, else the seconds until one is available
+    async def take(self, key, rate, burst):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(burst), now]
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0.0
+            return (1 - bucket[0]) / rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+def _load_backend(spec):
+    if spec == "memory":
+        return MemoryBackend()
+    module, _, attribute = spec.partition(":")
+    return getattr(importlib.import_module(module), attribute)
+
+
+backend = _load_backend(RATE_LIMIT_BACKEND)
+
+
+class RateLimiter:
+    def __init__(self, name, per_minute, burst):
+        self.name = name
+        self.rate = per_minute / 60
+        self.burst = burst
+
+    # Raises 429 with Retry-After once `key` has used up its bucket
+    async def check(self, key):
+        retry_after = await backend.take(f"{self.name}:{key}", self.rate, self.burst)
+        if retry_after:
+            rate_limited.inc(self.name)
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                                detail="Too many login attempts, please retry later",
+                                headers={"Retry-After": str(math.ceil(retry_after))})
+
+
+login_ip_limiter = RateLimiter("login_ip", LOGIN_RATE_PER_IP, LOGIN_BURST_PER_IP)
+login_user_limiter = RateLimiter("login_user", LOGIN_RATE_PER_USER, LOGIN_BURST_PER_USER)
+
+
+def client_address(request):
+    if RATE_LIMIT_TRUST_FORWARDED:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+# Called by the login endpoints before they borrow a connection
+async def check_login_rate(request, username):
+    await login_ip_limiter.check(client_address(request))
+    await login_user_limiter.check(username.lower())
+
+
+def rate_limit_stats():
+    return {
+        "backend": RATE_LIMIT_BACKEND,
+        "buckets": len(backend) if isinstance(backend, MemoryBackend) else None,
+        "limited": {limiter: count for (limiter,), count in rate_limited.series().items()},
+    }
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import os
+import types
+import typing
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from functools import lru_cache
+
+import orjson
+from fastapi.responses import Response, StreamingResponse
+from pydantic import TypeAdapter
+
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", 15))
+
+
+# Column types mysql.connector returns that orjson does not handle natively
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, timedelta):
+        return str(value)
+    raise TypeError
+
+
+def _to_str(value):
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode()
+    return value if isinstance(value, str) else str(value)
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value
+
+
+# Cheap conversions for the column types the response models use, mirroring what
+# Pydantic does to those values (DATETIME narrowed to date, DECIMAL/VARCHAR to int...)
+_CONVERTERS = {
+    str: _to_str,
+    int: int,
+    float: float,
+    bool: bool,
+    date: _to_date,
+}
+
+
+def _converter(annotation):
+    # Optional[X] converts like X; None is passed through untouched
+    args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+    if typing.get_origin(annotation) in (typing.Union, types.UnionType) and len(args) == 1:
+        annotation = args[0]
+    if annotation in _CONVERTERS:
+        return _CONVERTERS[annotation]
+    if annotation is datetime:
+        return None
+
+    # Anything else goes through Pydantic itself, once per value
+    adapter = TypeAdapter(annotation)
+    return lambda value: adapter.dump_python(adapter.validate_python(value), mode="json")
+
+
+# (field, converter) pairs of `model`, in declaration order
+@lru_cache(maxsize=None)
+def _fields(model):
+    return tuple((name, _converter(field.annotation)) for name, field in model.model_fields.items())
+
+
+# Keep only the fields `model` declares, in its order, converted to the declared
+# types, so the payload matches what response_model would produce
+def _project(row, fields):
+    item = {}
+    for field, convert in fields:
+        value = row.get(field)
+        item[field] = convert(value) if convert is not None and value is not None else value
+    return item
+
+
+# Serialize cursor rows straight to JSON with orjson instead of building one
+# Pydantic model per row and having FastAPI validate the list again against
+# response_model. The route keeps its response_model for the OpenAPI schema.
+# Headers set on the route's injected `response` (cursors, ETags) are carried over.
+def rows_response(rows, model, response=None):
+    fields = _fields(model)
+    body = orjson.dumps([_project(row, fields) for row in rows], default=_json_default)
+    headers = dict(response.headers) if response is not None else None
+    if headers:
+        headers.pop("content-length", None)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+# Stream rows from an async iterator as newline-delimited JSON, serializing each
+# row as it goes instead of building the whole list in memory
+def ndjson_response(rows, model):
+    fields = _fields(model)
+
+    async def body():
+        async for row in rows:
+            yield orjson.dumps(_project(row, fields), default=_json_default, option=orjson.OPT_APPEND_NEWLINE)
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+# Tag the response with `etag`; if the client already holds that version, return
+# an empty 304 for the endpoint to send instead of rebuilding the body
+def not_modified(request, response, etag):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return None
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    if "*" in tags or etag in tags or etag.removeprefix("W/") in tags:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+    return None
+
+
+# Server-sent events for everything published to `topic` on `bus` while the client
+# stays connected. A comment line goes out every SSE_HEARTBEAT_SECONDS so proxies
+# keep idle streams open; the subscription ends when the client disconnects.
+def sse_response(bus, topic):
+    async def body():
+        with bus.subscribe(topic) as events:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(events.get(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+    return StreamingResponse(body(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -0,0 +1,202 @@
+import hashlib
+import heapq
+import math
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from anyio import to_thread
+
+from core.middleware import logger
+from db.db import db_connection, prepared
+
+# Revoked tokens are recorded by their jti claim in the revoked_tokens table:
+#
+#   CREATE TABLE revoked_tokens (
+#       id BIGINT AUTO_INCREMENT PRIMARY KEY,
+#       jti CHAR(32) NOT NULL UNIQUE,
+#       expires_at DATETIME NOT NULL,
+#       revoked_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+#       KEY (expires_at),
+#       KEY (revoked_at, id)
+#   );
+#
+# Every process keeps the unexpired jtis in memory and polls the table for rows
+# revoked since its last poll, so checking a token never touches the database.
+# Auto-increment ids are not committed in order, so each poll re-reads an
+# overlapping window of REVOCATION_POLL_OVERLAP_SECONDS before the newest
+# revoked_at seen; rows already loaded are skipped. A bloom filter
+# in front of the exact set answers the common "not revoked" case with a few bit
+# lookups; only possible hits go on to the set.
+REVOCATION_REFRESH_SECONDS = float(os.getenv("REVOCATION_REFRESH_SECONDS", 5))
+REVOCATION_BATCH_SIZE = int(os.getenv("REVOCATION_BATCH_SIZE", 10000))
+REVOCATION_POLL_OVERLAP_SECONDS = float(os.getenv("REVOCATION_POLL_OVERLAP_SECONDS", 60))
+# Sizing of the bloom filter; past this many revoked tokens its false positive
+# rate grows (hits are still confirmed against the exact set)
+REVOCATION_BLOOM_CAPACITY = int(os.getenv("REVOCATION_BLOOM_CAPACITY", 1000000))
+REVOCATION_BLOOM_ERROR_RATE = float(os.getenv("REVOCATION_BLOOM_ERROR_RATE", 0.001))
+# How often expired rows are deleted from revoked_tokens
+REVOCATION_PURGE_SECONDS = float(os.getenv("REVOCATION_PURGE_SECONDS", 3600))
+
+INSERT_REVOKED = prepared("INSERT IGNORE INTO revoked_tokens (jti, expires_at) VALUES (%s, %s)")
+# Keyset over (revoked_at, id)
+REVOKED_SINCE = prepared("SELECT id, jti, expires_at, revoked_at FROM revoked_tokens "
+                         "WHERE (revoked_at, id) > (%s, %s) AND expires_at > %s "
+                         "ORDER BY revoked_at, id LIMIT %s")
+PURGE_REVOKED = prepared("DELETE FROM revoked_tokens WHERE expires_at <= %s")
+
+
+# revoked_tokens stores UTC times without a zone
+def _db_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    # Double hashing: k positions derived from the two halves of one digest
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    @property
+    def nbytes(self):
+        return len(self._bits)
+
+
+class RevocationList:
+    def __init__(self):
+        self._bloom = BloomFilter(REVOCATION_BLOOM_CAPACITY, REVOCATION_BLOOM_ERROR_RATE)
+        # Revoked jtis, plus a heap of (expiry, jti) so expired entries can be
+        # dropped on refresh without scanning them all
+        self._revoked = set()
+        self._expiries = []
+        # Newest revoked_at loaded so far (a database timestamp)
+        self._seen_until = None
+        self._loaded = False
+        self._rebuilding = None
+        self._expired_since_rebuild = 0
+        self._purged_at = time.monotonic()
+        self.refreshed_at = None
+
+        self.checks = 0
+        self.bloom_hits = 0
+        self.false_positives = 0
+
+    def is_revoked(self, jti):
+        self.checks += 1
+        if jti not in self._bloom:
+            return False
+        self.bloom_hits += 1
+        if jti in self._revoked:
+            return True
+        self.false_positives += 1
+        return False
+
+    def add(self, jti, expires_at):
+        if jti in self._revoked:
+            return
+        self._revoked.add(jti)
+        heapq.heappush(self._expiries, (expires_at, jti))
+        self._bloom.add(jti)
+        if self._rebuilding is not None:
+            self._rebuilding.append(jti)
+
+    # Record a revocation; takes effect in this process at once and in the others
+    # at their next refresh. Returns False when the token had already been revoked,
+    # by any process, which lets single-use tokens be claimed exactly once.
+    async def revoke(self, cursor, connection, jti, expires_at):
+        await cursor.execute(INSERT_REVOKED, (jti, _db_time(expires_at)))
+        inserted = cursor.rowcount == 1
+        await connection.commit()
+        self.add(jti, expires_at)
+        return inserted
+
+    # Expired tokens are rejected by their signature check anyway. Bits cannot be
+    # cleared from a bloom filter, so once enough entries are gone it is rebuilt
+    # from the remaining ones on a worker thread.
+    async def _prune(self):
+        now = time.time()
+        while self._expiries and self._expiries[0][0] <= now:
+            _, jti = heapq.heappop(self._expiries)
+            self._revoked.discard(jti)
+            self._expired_since_rebuild += 1
+        if not self._expired_since_rebuild or self._expired_since_rebuild < len(self._revoked) // 10:
+            return
+
+        self._rebuilding = []
+        try:
+            bloom = await to_thread.run_sync(self._build, list(self._revoked))
+            for jti in self._rebuilding:
+                bloom.add(jti)
+            self._bloom = bloom
+            self._expired_since_rebuild = 0
+        finally:
+            self._rebuilding = None
+
+    @staticmethod
+    def _build(jtis):
+        bloom = BloomFilter(REVOCATION_BLOOM_CAPACITY, REVOCATION_BLOOM_ERROR_RATE)
+        for jti in jtis:
+            bloom.add(jti)
+        return bloom
+
+    # Periodic job: load revocations recorded since the last refresh (everything
+    # unexpired on the first run), then prune expired entries
+    async def refresh(self):
+        if self._seen_until is None:
+            position = (datetime(1970, 1, 1), 0)
+        else:
+            position = (self._seen_until - timedelta(seconds=REVOCATION_POLL_OVERLAP_SECONDS), 0)
+
+        async with db_connection() as (cursor, connection):
+            while True:
+                await cursor.execute(REVOKED_SINCE, (*position, _db_time(time.time()), REVOCATION_BATCH_SIZE))
+                rows = await cursor.fetchall()
+                for row in rows:
+                    self.add(row["jti"], row["expires_at"].replace(tzinfo=timezone.utc).timestamp())
+                if rows:
+                    position = (rows[-1]["revoked_at"], rows[-1]["id"])
+                    if self._seen_until is None or position[0] > self._seen_until:
+                        self._seen_until = position[0]
+                if len(rows) < REVOCATION_BATCH_SIZE:
+                    break
+
+            if time.monotonic() - self._purged_at >= REVOCATION_PURGE_SECONDS:
+                await cursor.execute(PURGE_REVOKED, (_db_time(time.time()),))
+                await connection.commit()
+                self._purged_at = time.monotonic()
+
+        await self._prune()
+        if not self._loaded:
+            logger.info(f"Loaded {len(self._revoked)} revoked tokens")
+            self._loaded = True
+        self.refreshed_at = datetime.now(timezone.utc)
+
+    def stats(self):
+        return {
+            "revoked": len(self._revoked),
+            "seen_until": self._seen_until,
+            "refreshed_at": self.refreshed_at,
+            "bloom_bytes": self._bloom.nbytes,
+            "bloom_hashes": self._bloom.hashes,
+            "checks": self.checks,
+            "bloom_hits": self.bloom_hits,
+            "false_positives": self.false_positives,
+        }
+
+
+revocation_list = RevocationList()
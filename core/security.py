@@ -1,21 +1,45 @@
+import asyncio
+import hashlib
 import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone, date
+from functools import partial
 from typing import Optional, Annotated
 import jwt
-from fastapi import Depends, HTTPException, status, APIRouter
+from fastapi import Depends, HTTPException, status, APIRouter, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from passlib.context import CryptContext
-from classes.security  import Token,TokenData,User,UserInDB
-from db.db import get_db
+from classes.security  import Token,TokenData,User,UserInDB,Principal
+from core.cache import TTLCache
+from core.ratelimit import check_login_rate
+from core.revocation import revocation_list
+from db.db import prepared, request_connection
 
 
 router = APIRouter()
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 600000
+# Access tokens are short-lived; clients renew them with the refresh token returned
+# at login (POST /login/refresh)
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+REFRESH_TOKEN_EXPIRE_MINUTES = int(os.getenv("REFRESH_TOKEN_EXPIRE_MINUTES", 7 * 24 * 60))
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Authenticated users are cached by username so polling clients do not re-read
+# the users table on every request. Writes to users must call invalidate_user.
+user_cache = TTLCache("users", int(os.getenv("USER_CACHE_SIZE", 10000)), float(os.getenv("USER_CACHE_TTL", 60)))
+principal_cache = TTLCache("principals", int(os.getenv("PRINCIPAL_CACHE_SIZE", 10000)),
+                           float(os.getenv("PRINCIPAL_CACHE_TTL", 60)))
+# Verified claims of access tokens, keyed by a digest of the token, so a token's
+# signature is checked once instead of on every request. An entry never outlives
+# the token's own expiry.
+token_cache = TTLCache("token_claims", int(os.getenv("TOKEN_CACHE_SIZE", 10000)),
+                       float(os.getenv("TOKEN_CACHE_TTL", ACCESS_TOKEN_EXPIRE_MINUTES * 60)))
+
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -24,27 +48,93 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+
+# bcrypt costs 100-300ms of CPU per call, so hashing and verification run on a
+# small dedicated thread pool instead of the event loop. Once HASH_QUEUE_LIMIT
+# calls are in flight new ones are refused with 503 rather than queued forever.
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", 4))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", 64))
+_hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+hash_stats = {"in_flight": 0, "completed": 0, "failed": 0, "rejected": 0}
+_hash_stats_lock = threading.Lock()
+
+
+# Runs when the hash itself finishes (on the worker thread), not when the caller
+# stops waiting: a cancelled request does not stop a bcrypt call already running
+def _hash_done(future):
+    with _hash_stats_lock:
+        hash_stats["in_flight"] -= 1
+        if future.cancelled() or future.exception() is not None:
+            hash_stats["failed"] += 1
+        else:
+            hash_stats["completed"] += 1
+
+
+async def _run_hash(func, *args):
+    with _hash_stats_lock:
+        if hash_stats["in_flight"] >= HASH_QUEUE_LIMIT:
+            hash_stats["rejected"] += 1
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server busy, please retry",
+                                headers={"Retry-After": "1"})
+        hash_stats["in_flight"] += 1
+
+    future = _hash_executor.submit(partial(func, *args))
+    future.add_done_callback(_hash_done)
+    return await asyncio.wrap_future(future)
+
+
+async def verify_password_async(plain_password, hashed_password):
+    return await _run_hash(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password):
+    return await _run_hash(get_password_hash, password)
+
 # User authentication and database query
-def get_user(cursor, username: str):
-    query = "SELECT * FROM users WHERE username = %s"
-    cursor.execute(query, (username,))
-    user_record = cursor.fetchone()
+# Auth-check statements run on every cache miss, so they are prepared once per connection
+USER_BY_USERNAME = prepared("SELECT * FROM users WHERE username = %s")
+USER_ACCESS_BY_USERNAME = prepared("SELECT is_admin, is_supervisor FROM user_access WHERE username = %s")
+
+
+async def get_user(cursor, username: str):
+    await cursor.execute(USER_BY_USERNAME, (username,))
+    user_record = await cursor.fetchone()
     if user_record:
         return UserInDB(**user_record)
     return None
 
 
-def authenticate_user(cursor, username: str, password: str):
-    user = get_user(cursor, username)
-    if not user or not verify_password(password, user['password']):
+async def get_cached_user(cursor, username: str):
+    user = user_cache.get(username)
+    if user is None:
+        user = await get_user(cursor, username)
+        if user is not None:
+            user_cache.set(username, user)
+    return user
+
+
+def invalidate_user(username: str):
+    user_cache.invalidate(username)
+    principal_cache.invalidate(username)
+
+
+# The password is checked after the connection is back in the pool: bcrypt may
+# queue for a hash worker, and logins holding connections meanwhile would drain it
+async def authenticate_user(username: str, password: str):
+    async with request_connection() as (cursor, _):
+        user = await get_user(cursor, username)
+    if not user or not await verify_password_async(password, user.password):
         return False
     return user
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + (expires_delta if expires_delta else timedelta(minutes=100000))
+    expire = datetime.now(timezone.utc) + (expires_delta if expires_delta else
+                                           timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
+    # Unique id, so the token can be revoked (core.revocation)
+    to_encode.setdefault("jti", uuid.uuid4().hex)
 
     if "sub" not in to_encode:
         raise ValueError("The 'sub' claim must be set in the token")
@@ -53,24 +143,111 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-# Dependency to get the current user
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db=Depends(get_db)):
-    cursor, connection = db
-    credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                                          detail="Could not validate credentials",
-                                          headers={"WWW-Authenticate": "Bearer"}, )
+# Refresh tokens only identify the user; they are never accepted as access tokens
+def create_refresh_token(username: str):
+    expire = datetime.now(timezone.utc) + timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES)
+    return jwt.encode({"sub": username, "type": "refresh", "exp": expire, "jti": uuid.uuid4().hex},
+                      SECRET_KEY, algorithm=ALGORITHM)
+
+
+def decode_refresh_token(token: str):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        raise credentials_exception
+    if payload.get("type") != "refresh" or payload.get("sub") is None or _revoked(payload):
+        raise credentials_exception
+    return payload
+
+
+# Tokens without a jti predate revocation support and cannot be revoked, so they
+# are refused as well
+def _revoked(claims):
+    jti = claims.get("jti")
+    return jti is None or revocation_list.is_revoked(jti)
+
+
+# Verified claims of an access token, from token_cache when it has been seen
+# before. Raises jwt.PyJWTError for invalid, expired or revoked tokens; the
+# revocation check runs on every call, cached or not.
+def decode_token(token: str):
+    key = hashlib.sha256(token.encode()).digest()
+    claims = token_cache.get(key)
+    if claims is None:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        if claims.get("type", "access") != "access":
+            raise jwt.InvalidTokenError("Not an access token")
+        ttl = token_cache.ttl
+        if "exp" in claims:
+            ttl = min(ttl, claims["exp"] - time.time())
+        token_cache.set(key, claims, ttl=ttl)
+    if _revoked(claims):
+        raise jwt.InvalidTokenError("Token has been revoked")
+    return claims
+
+
+# Claims of a valid token, empty for an invalid one (authentication itself is
+# checked by get_current_user)
+def token_claims(token: str):
+    try:
+        return decode_token(token)
+    except jwt.PyJWTError:
+        return {}
+
+
+def token_role(token: str):
+    return token_claims(token).get("role")
+
+
+# Dependency for authenticated routes: draws the connection from the pool matching
+# the role carried in the access token (tokens without a role use the employee pool).
+# Commits made on it keep the user's reads on the primary for a while (see db.db).
+async def get_role_db(token: Annotated[str, Depends(oauth2_scheme)]):
+    claims = token_claims(token)
+    async with request_connection(claims.get("role"), session=claims.get("sub")) as db:
+        yield db
+
+
+credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                                      detail="Could not validate credentials",
+                                      headers={"WWW-Authenticate": "Bearer"}, )
+
+
+def token_username(token: str):
+    try:
+        payload = decode_token(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
         token_data = TokenData(username=username)
     except jwt.PyJWTError:
         raise credentials_exception
+    return token_data.username
+
+
+# Dependency to get the current user
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db=Depends(get_role_db)):
+    cursor, connection = db
+    user = await get_cached_user(cursor, username=token_username(token))
+    if user is None:
+        raise credentials_exception
+    return user
+
+
+# Same as get_current_active_user, for long-lived requests (long-polls, event
+# streams): a connection is only borrowed on a cache miss, not held for the
+# lifetime of the request
+async def get_current_user_detached(token: Annotated[str, Depends(oauth2_scheme)]):
+    username = token_username(token)
+    user = user_cache.get(username)
+    if user is None:
+        async with request_connection(token_role(token)) as (cursor, _):
+            user = await get_cached_user(cursor, username)
 
-    user = get_user(cursor, username=token_data.username)
     if user is None:
         raise credentials_exception
+    if user.disabled:
+        raise HTTPException(status_code=400, detail="Inactive user")
     return user
 
 
@@ -81,18 +258,62 @@ async def get_current_active_user(current_user: Annotated[User, Depends(get_curr
     return current_user
 
 
+# Same as get_current_principal for long-lived requests: no connection is held
+# once the caller has been authenticated
+async def get_current_principal_detached(token: Annotated[str, Depends(oauth2_scheme)],
+                                         current_user: Annotated[User, Depends(get_current_user_detached)]):
+    principal = principal_cache.get(current_user.username)
+    if principal is None:
+        async with request_connection(token_role(token)) as (cursor, _):
+            principal = await resolve_principal(cursor, current_user.username)
+        principal_cache.set(current_user.username, principal)
+    return principal
+
+
+# Look up the caller's employee id and access flags in one go
+async def resolve_principal(cursor, username: str):
+    await cursor.execute(USER_ACCESS_BY_USERNAME, (username,))
+    access = await cursor.fetchone() or {}
+
+    await cursor.callproc("get_employee_id_by_username", [username])
+    result = next(cursor.stored_results(), None)
+    employee_record = result.fetchone() if result else None
+
+    is_admin = bool(access.get("is_admin"))
+    is_supervisor = bool(access.get("is_supervisor"))
+    return Principal(
+        username=username,
+        employee_id=employee_record["employee_id"] if employee_record else None,
+        is_admin=is_admin,
+        is_supervisor=is_supervisor,
+        role="admin" if is_admin else "supervisor" if is_supervisor else "employee",
+    )
+
+
+# Dependency giving the authenticated caller's privileges, cached across requests
+async def get_current_principal(current_user: Annotated[User, Depends(get_current_active_user)],
+                                db=Depends(get_role_db)):
+    principal = principal_cache.get(current_user.username)
+    if principal is None:
+        cursor, _ = db
+        principal = await resolve_principal(cursor, current_user.username)
+        principal_cache.set(current_user.username, principal)
+    return principal
+
+
 # Endpoint to log in and get the access token
 @router.post("/token", response_model=Token)
-async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db=Depends(get_db)):
-    cursor, connection = db
-    user = authenticate_user(cursor, form_data.username, form_data.password)
+async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], request: Request):
+    await check_login_rate(request, form_data.username)
+    user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password",
                             headers={"WWW-Authenticate": "Bearer"}, )
 
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(data={"sub": user['username']}, expires_delta=access_token_expires)
-    return {"access_token": access_token, "token_type": "bearer"}
+    access_token = create_access_token(data={"sub": user.username}, expires_delta=access_token_expires)
+    return {"access_token": access_token, "token_type": "bearer",
+            "refresh_token": create_refresh_token(user.username)}
 
 
 # Endpoint to get current user details
@@ -0,0 +1,127 @@
+import asyncio
+import os
+import time
+
+from core.cache import caches
+from core.metrics import request_scope
+from core.middleware import logger
+from core.versions import resource_versions
+from db.db import db_connection
+
+
+# Build a loader that runs a stored procedure and returns its first result set
+def proc_loader(procname, one=False):
+    async def load(cursor):
+        await cursor.callproc(procname)
+        result = next(cursor.stored_results())
+        return result.fetchone() if one else result.fetchall()
+    return load
+
+
+# Shared cache for dashboard aggregates. Values older than `ttl` (or invalidated
+# by a write) are still served while a background task reloads them, so only the
+# very first reader of an aggregate ever waits on the database.
+class StatsCache:
+    def __init__(self, name, ttl):
+        self.ttl = ttl
+        self._loaders = {}
+        self._entries = {}
+        self._refreshing = {}
+        self._generations = {}
+        self._versions = {}
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refresh_errors = 0
+        self.load_seconds = {}
+        caches[name] = self
+
+    def register(self, name, loader, tags=()):
+        self._loaders[name] = (loader, set(tags))
+
+    async def _load(self, name):
+        # Runs as its own task; don't attribute its queries to the request that triggered it
+        request_scope.set(None)
+        loader, _ = self._loaders[name]
+        generation = self._generations.get(name, 0)
+        started = time.perf_counter()
+        try:
+            # Served from a replica unless something was committed in the last few seconds
+            async with db_connection(read_only=True) as (cursor, _):
+                value = await loader(cursor)
+        finally:
+            self._refreshing.pop(name, None)
+        self.load_seconds[name] = round(time.perf_counter() - started, 6)
+        # A write landed while we were loading, so keep the value but mark it stale
+        loaded_at = time.monotonic() if generation == self._generations.get(name, 0) else float("-inf")
+        self._entries[name] = (loaded_at, value)
+        self._versions[name] = self._versions.get(name, 0) + 1
+        return value
+
+    def _refresh(self, name):
+        task = self._refreshing.get(name)
+        if task is None:
+            task = asyncio.create_task(self._load(name))
+            task.add_done_callback(self._log_failure)
+            self._refreshing[name] = task
+        return task
+
+    def _log_failure(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            self.refresh_errors += 1
+            logger.error(f"Refreshing dashboard statistics failed: {task.exception()}")
+
+    async def get(self, name):
+        entry = self._entries.get(name)
+        if entry is None:
+            self.misses += 1
+            return await asyncio.shield(self._refresh(name))
+
+        loaded_at, value = entry
+        if time.monotonic() - loaded_at < self.ttl:
+            self.hits += 1
+        else:
+            self.stale_hits += 1
+            self._refresh(name)
+        return value
+
+    # Number of times `name` has been loaded; part of the ETag of responses built
+    # from it, so clients revalidate only once a fresh value is actually served
+    def version(self, name):
+        return self._versions.get(name, 0)
+
+    # Mark every aggregate depending on one of `tags` as stale and reload it. Write
+    # endpoints call this after every commit, so it also bumps the tags' change
+    # counters used for the ETags of uncached listings.
+    def invalidate(self, *tags):
+        resource_versions.bump(*tags)
+        for name, (_, depends_on) in self._loaders.items():
+            if not depends_on.intersection(tags):
+                continue
+            self._generations[name] = self._generations.get(name, 0) + 1
+            if name in self._entries:
+                self._entries[name] = (float("-inf"), self._entries[name][1])
+                self._refresh(name)
+
+    # Load every registered aggregate in the background (called on startup)
+    def warm(self):
+        for name in self._loaders:
+            if name not in self._entries:
+                self._refresh(name)
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+            "refresh_errors": self.refresh_errors,
+            "load_seconds": self.load_seconds,
+        }
+
+
+stats_cache = StatsCache("dashboard_stats", float(os.getenv("STATS_CACHE_TTL", 300)))
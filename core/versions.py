@@ -0,0 +1,41 @@
+import hashlib
+import os
+import time
+import uuid
+
+# Changes with every restart so ETags issued by an earlier process never match
+_BOOT_ID = uuid.uuid4().hex
+
+
+# The counters only see writes made through this process, so an ETag is also tied
+# to a RESOURCE_VERSION_MAX_AGE window: changes made by other workers or directly
+# in the database show up at the latest once the window rolls over
+RESOURCE_VERSION_MAX_AGE = float(os.getenv("RESOURCE_VERSION_MAX_AGE", 30))
+
+
+# Change counters per resource ("employees", "leaves", "users"). Write endpoints
+# bump the resources they touch; read endpoints build their ETag from the
+# counters they depend on, so a conditional GET can be answered without MySQL.
+class ResourceVersions:
+    def __init__(self):
+        self._counters = {}
+
+    def bump(self, *resources):
+        for resource in resources:
+            self._counters[resource] = self._counters.get(resource, 0) + 1
+
+    def get(self, resource):
+        return self._counters.get(resource, 0)
+
+    # Weak ETag over the given resources plus anything else the response depends
+    # on (e.g. the supervisor whose team is listed)
+    def etag(self, *resources, scope=()):
+        window = int(time.time() // RESOURCE_VERSION_MAX_AGE)
+        key = repr((_BOOT_ID, window, [(resource, self.get(resource)) for resource in resources], scope))
+        return f'W/"{hashlib.blake2b(key.encode(), digest_size=12).hexdigest()}"'
+
+    def stats(self):
+        return dict(self._counters)
+
+
+resource_versions = ResourceVersions()
@@ -1,50 +1,671 @@
+import itertools
 import logging
 import os
-from mysql.connector import pooling, connect, Error
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import partial
+
+import anyio
+from anyio import to_thread
+from mysql.connector import pooling, connect, errorcode, Error
 from dotenv import load_dotenv
+from fastapi import HTTPException, status
+
+from core.metrics import Counter, Gauge, Histogram, endpoint_label
 
 load_dotenv()
 
-# Define global connection pools for admin, supervisor, and employee
-admin_pool = pooling.MySQLConnectionPool(
-    pool_name="admin_pool",
-    pool_size=5,
-    host=os.getenv('DB_HOST'),
-    user=os.getenv('DB_ADMIN_USER'),
-    password=os.getenv('DB_ADMIN_PASSWORD'),
-    database=os.getenv('DB_NAME')
-)
-
-supervisor_pool = pooling.MySQLConnectionPool(
-    pool_name="supervisor_pool",
-    pool_size=50,
-    host=os.getenv('DB_HOST'),
-    user=os.getenv('DB_SUPERVISOR_USER'),
-    password=os.getenv('DB_SUPERVISOR_PASSWORD'),
-    database=os.getenv('DB_NAME')
-)
-
-employee_pool = pooling.MySQLConnectionPool(
-    pool_name="employee_pool",
-    pool_size=1000,
-    host=os.getenv('DB_HOST'),
-    user=os.getenv('DB_EMPLOYEE_USER'),
-    password=os.getenv('DB_EMPLOYEE_PASSWORD'),
-    database=os.getenv('DB_NAME')
-)
-
-# Retrieve a connection based on role
-async def get_db(role='employee'):
+logger = logging.getLogger(__name__)
+
+# mysql.connector is a blocking driver, so every call that talks to the server is
+# pushed onto a dedicated worker thread pool instead of running on the event loop.
+# The limiter caps how many driver calls run at once, independently of the pool
+# FastAPI uses for plain `def` routes.
+DB_THREADS = int(os.getenv('DB_THREADS', 40))
+_db_limiter = None
+
+
+def _get_limiter():
+    # CapacityLimiter has to be created inside a running event loop
+    global _db_limiter
+    if _db_limiter is None:
+        _db_limiter = anyio.CapacityLimiter(DB_THREADS)
+    return _db_limiter
+
+
+async def run_db(func, *args, **kwargs):
+    return await to_thread.run_sync(partial(func, *args, **kwargs), limiter=_get_limiter())
+
+
+# Server-side prepared statements. SQL registered with prepared() is prepared once
+# per pooled connection and the prepared cursor stays attached to that connection,
+# so later requests on it only send the parameters. Everything else (stored
+# procedures, dynamically built SQL) goes through the plain dictionary cursor.
+# Sessions are not reset when a connection goes back to the pool, since that would
+# drop the prepared statements; releasing a connection rolls back instead.
+DB_PREPARED_STATEMENTS = os.getenv('DB_PREPARED_STATEMENTS', 'true').lower() in ('1', 'true', 'yes')
+
+# Registered SQL -> the canonical string object; mysql.connector only reuses a
+# prepared statement when it is executed with the very same string object
+_statements = {}
+statement_counters = {}
+unprepared_counters = {"execute": 0, "callproc": 0}
+
+
+def prepared(sql):
+    sql = _statements.setdefault(sql, sql)
+    statement_counters.setdefault(sql, {"prepares": 0, "reuses": 0})
+    return sql
+
+
+def _prepared_cursors(conn):
+    cnx = getattr(conn, '_cnx', conn)
+    cursors = getattr(cnx, '_prepared_cursors', None)
+    if cursors is None:
+        cursors = cnx._prepared_cursors = {}
+    return cursors
+
+
+# Runs in a worker thread. Rows are read eagerly because prepared cursors are
+# unbuffered and must not leave a result pending on the connection.
+def _execute_prepared(conn, sql, params):
+    cursors = _prepared_cursors(conn)
+    counters = statement_counters[sql]
+    cursor = cursors.get(sql)
+    if cursor is None:
+        cursor = cursors[sql] = conn.cursor(prepared=True, dictionary=True)
+        counters["prepares"] += 1
+    else:
+        counters["reuses"] += 1
+
+    try:
+        cursor.execute(sql, params)
+    except Error as e:
+        if e.errno != errorcode.ER_UNKNOWN_STMT_HANDLER:
+            raise
+        # The connection was re-established and lost its statements
+        cursors.clear()
+        cursor = cursors[sql] = conn.cursor(prepared=True, dictionary=True)
+        counters["prepares"] += 1
+        cursor.execute(sql, params)
+
+    rows = cursor.fetchall() if cursor.with_rows else []
+    return rows, cursor.rowcount, cursor.lastrowid
+
+
+def statement_stats():
+    prepares = sum(counters["prepares"] for counters in statement_counters.values())
+    reuses = sum(counters["reuses"] for counters in statement_counters.values())
+    return {
+        "enabled": DB_PREPARED_STATEMENTS,
+        "prepares": prepares,
+        "reuses": reuses,
+        "reuse_ratio": round(reuses / (prepares + reuses), 4) if prepares + reuses else 0.0,
+        "unprepared": unprepared_counters,
+        "statements": {" ".join(sql.split()): counters for sql, counters in statement_counters.items()},
+    }
+
+
+# Query instrumentation: every execute/callproc is timed (including the wait for a
+# DB thread) and counted per endpoint and statement. A stored procedure is labelled
+# by its name, other SQL by the call site that issued it, which keeps the label
+# set small even for dynamically built queries. Statements slower than
+# DB_SLOW_QUERY_SECONDS are logged with their SQL.
+DB_SLOW_QUERY_SECONDS = float(os.getenv('DB_SLOW_QUERY_SECONDS', 0.5))
+
+query_seconds = Histogram("db_query_duration_seconds", "Duration of database statements",
+                          ("endpoint", "statement"))
+query_rows = Counter("db_query_rows_total", "Rows returned or affected by database statements",
+                     ("endpoint", "statement"))
+slow_queries = Counter("db_slow_queries_total", "Database statements slower than DB_SLOW_QUERY_SECONDS",
+                       ("endpoint", "statement"))
+
+
+# First frame outside this module: the handler or helper that issued the query
+def _call_site():
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_globals.get('__name__') == __name__:
+        frame = frame.f_back
+    if frame is None:
+        return "unknown"
+    return f"{frame.f_globals.get('__name__')}.{frame.f_code.co_name}:{frame.f_lineno}"
+
+
+def _observe(statement, started, rows, sql):
+    seconds = time.perf_counter() - started
+    endpoint = endpoint_label()
+    query_seconds.observe(seconds, endpoint, statement)
+    if rows > 0:
+        query_rows.inc(endpoint, statement, amount=rows)
+    if seconds >= DB_SLOW_QUERY_SECONDS:
+        slow_queries.inc(endpoint, statement)
+        logger.warning(f"Slow query ({seconds:.3f}s) from {statement} on {endpoint}: {' '.join(sql.split())[:500]}")
+
+
+# Awaitable wrapper around a dictionary cursor. Result sets produced by callproc
+# are buffered by the driver, so stored_results() stays synchronous. Registered
+# statements run on the connection's prepared cursors and their rows are served
+# from memory.
+class AsyncCursor:
+    def __init__(self, cursor, conn=None):
+        self._cursor = cursor
+        self._conn = conn
+        self._rows = None
+        self._rowcount = -1
+        self._lastrowid = None
+        self._statement = None
+
+    async def execute(self, operation, params=None):
+        self._statement = _call_site()
+        started = time.perf_counter()
+        statement = _statements.get(operation) if DB_PREPARED_STATEMENTS and self._conn is not None else None
+        if statement is None:
+            self._rows = None
+            unprepared_counters["execute"] += 1
+            try:
+                return await run_db(self._cursor.execute, operation, params)
+            finally:
+                _observe(self._statement, started, self._cursor.rowcount, operation)
+
+        try:
+            rows, self._rowcount, self._lastrowid = await run_db(_execute_prepared, self._conn, statement, params)
+        finally:
+            _observe(self._statement, started, self._rowcount, operation)
+        self._rows = deque(rows)
+
+    async def callproc(self, procname, args=()):
+        self._rows = None
+        self._statement = f"CALL {procname}"
+        unprepared_counters["callproc"] += 1
+        started = time.perf_counter()
+        rows = 0
+        try:
+            result = await run_db(self._cursor.callproc, procname, args)
+            rows = sum(max(stored.rowcount, 0) for stored in self._cursor.stored_results())
+            return result
+        finally:
+            _observe(self._statement, started, rows, self._statement)
+
+    # Rows of unbuffered results are only known once fetched
+    def _count_fetched(self, rows):
+        if rows:
+            query_rows.inc(endpoint_label(), self._statement, amount=len(rows))
+        return rows
+
+    async def fetchone(self):
+        if self._rows is not None:
+            return self._rows.popleft() if self._rows else None
+        row = await run_db(self._cursor.fetchone)
+        self._count_fetched([row] if row else None)
+        return row
+
+    async def fetchall(self):
+        if self._rows is not None:
+            rows = list(self._rows)
+            self._rows.clear()
+            return rows
+        return self._count_fetched(await run_db(self._cursor.fetchall))
+
+    async def fetchmany(self, size=1):
+        if self._rows is not None:
+            return [self._rows.popleft() for _ in range(min(size, len(self._rows)))]
+        return self._count_fetched(await run_db(self._cursor.fetchmany, size))
+
+    def stored_results(self):
+        return self._cursor.stored_results()
+
+    @property
+    def rowcount(self):
+        return self._rowcount if self._rows is not None else self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._lastrowid if self._rows is not None else self._cursor.lastrowid
+
+
+# Awaitable wrapper around a pooled connection. Commits are recorded for
+# read-your-writes routing (see record_write).
+class AsyncConnection:
+    def __init__(self, conn, session=None):
+        self._conn = conn
+        self._session = session
+
+    async def commit(self):
+        result = await run_db(self._conn.commit)
+        record_write(self._session)
+        return result
+
+    async def rollback(self):
+        return await run_db(self._conn.rollback)
+
+
+# Connection pools are created on first use and sized from configuration
+# (DB_<ROLE>_POOL_SIZE, capped at 32 by mysql.connector). A request waits up to
+# DB_POOL_TIMEOUT seconds for a free connection instead of failing immediately
+# when the pool is exhausted.
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def _checkout(pool):
+    conn = pool.get_connection()
     try:
-        if role == 'admin':
-            conn = admin_pool.get_connection()
-        elif role == 'supervisor':
-            conn = supervisor_pool.get_connection()
+        return conn, conn.cursor(dictionary=True)
+    except Exception:
+        conn.close()
+        raise
+
+
+def _release(cursor, conn):
+    try:
+        cursor.close()
+        if DB_PREPARED_STATEMENTS:
+            # Pooled sessions are not reset (see prepared()), so end any open transaction here
+            conn.rollback()
+    finally:
+        conn.close()
+
+
+class RolePool:
+    def __init__(self, role, user_env, password_env, default_size, host=None, port=None, name=None):
+        self.role = role
+        self.user_env = user_env
+        self.password_env = password_env
+        self.size = int(os.getenv(f'DB_{role.upper()}_POOL_SIZE', default_size))
+        # Replica pools connect to their own server; the primary pools use DB_HOST
+        self.host = host
+        self.port = port
+        self.name = name or role
+        self._pool = None
+        self._lock = threading.Lock()
+        self._slots = None
+
+        # Monitoring counters
+        self.checked_out = 0
+        self.waiters = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    logger.info(f"Creating {self.name} connection pool (size {self.size})")
+                    options = {'port': self.port} if self.port else {}
+                    self._pool = pooling.MySQLConnectionPool(
+                        pool_name=f"{self.name}_pool",
+                        pool_size=self.size,
+                        pool_reset_session=not DB_PREPARED_STATEMENTS,
+                        host=self.host or os.getenv('DB_HOST'),
+                        user=os.getenv(self.user_env),
+                        password=os.getenv(self.password_env),
+                        database=os.getenv('DB_NAME'),
+                        **options
+                    )
+        return self._pool
+
+    def get_connection(self):
+        return self._get_pool().get_connection()
+
+    async def acquire(self):
+        if self._slots is None:
+            self._slots = anyio.Semaphore(self.size)
+
+        self.waiters += 1
+        started = time.perf_counter()
+        try:
+            with anyio.fail_after(DB_POOL_TIMEOUT):
+                await self._slots.acquire()
+        except TimeoutError:
+            self.timeouts += 1
+            raise PoolTimeout(f"Timed out waiting for a {self.name} database connection")
+        finally:
+            self.waiters -= 1
+
+        waited = time.perf_counter() - started
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+
+        try:
+            conn, cursor = await run_db(_checkout, self)
+        except BaseException:
+            self._slots.release()
+            raise
+        self.acquired += 1
+        self.checked_out += 1
+        return conn, cursor
+
+    async def release(self, conn, cursor):
+        try:
+            await run_db(_release, cursor, conn)
+        finally:
+            self.checked_out -= 1
+            self._slots.release()
+
+    def stats(self):
+        return {
+            "created": self._pool is not None,
+            "size": self.size,
+            "checked_out": self.checked_out,
+            "waiters": self.waiters,
+            "acquired": self.acquired,
+            "timeouts": self.timeouts,
+            "wait_time_total": round(self.wait_time_total, 6),
+            "wait_time_avg": round(self.wait_time_total / self.acquired, 6) if self.acquired else 0.0,
+            "wait_time_max": round(self.wait_time_max, 6),
+        }
+
+
+# role -> (user variable, password variable, default pool size)
+ROLE_POOLS = {
+    'admin': ('DB_ADMIN_USER', 'DB_ADMIN_PASSWORD', 5),
+    'supervisor': ('DB_SUPERVISOR_USER', 'DB_SUPERVISOR_PASSWORD', 10),
+    'employee': ('DB_EMPLOYEE_USER', 'DB_EMPLOYEE_PASSWORD', 20),
+}
+pools = {role: RolePool(role, *config) for role, config in ROLE_POOLS.items()}
+
+
+# Map an application role (as returned by role_checker) onto a pool
+def pool_role(role):
+    role = (role or '').lower()
+    if 'admin' in role:
+        return 'admin'
+    if 'supervisor' in role:
+        return 'supervisor'
+    return 'employee'
+
+
+def pool_stats():
+    stats = {role: pool.stats() for role, pool in pools.items()}
+    for replica in replicas:
+        for role, pool in replica.pools.items():
+            stats[pool.name] = pool.stats()
+    return stats
+
+
+# Requests currently queued for a connection, across every pool (core.admission)
+def pool_waiters():
+    waiters = sum(pool.waiters for pool in pools.values())
+    for replica in replicas:
+        waiters += sum(pool.waiters for pool in replica.pools.values())
+    return waiters
+
+
+# Read replicas. DB_REPLICA_HOSTS lists the replica servers ("host" or "host:port",
+# comma separated), each with its own set of role pools using the same accounts as
+# the primary. Read-only connections (db_connection/request_connection with
+# read_only=True, opened by handlers once the caller is authenticated) go
+# round-robin to the replicas whose last health check passed with a lag of at most
+# DB_REPLICA_MAX_LAG seconds, and to the primary when there is none or when the
+# chosen replica cannot hand out a connection.
+DB_REPLICA_HOSTS = [host.strip() for host in os.getenv('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
+DB_REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', 5))
+DB_REPLICA_CHECK_SECONDS = float(os.getenv('DB_REPLICA_CHECK_SECONDS', 5))
+DB_REPLICA_CHECK_TIMEOUT = int(os.getenv('DB_REPLICA_CHECK_TIMEOUT', 2))
+# A server with no replication channels is kept out of rotation (its replication
+# may have been reset) unless this is set, e.g. for a second local instance used as
+# a stand-in replica
+DB_REPLICA_ALLOW_STANDALONE = os.getenv('DB_REPLICA_ALLOW_STANDALONE', 'false').lower() in ('1', 'true', 'yes')
+# Reading replication status needs the REPLICATION CLIENT privilege
+DB_REPLICA_MONITOR_USER = os.getenv('DB_REPLICA_MONITOR_USER', os.getenv('DB_ADMIN_USER'))
+DB_REPLICA_MONITOR_PASSWORD = os.getenv('DB_REPLICA_MONITOR_PASSWORD', os.getenv('DB_ADMIN_PASSWORD'))
+# Read-your-writes: after a commit, reads of the same session (the token's user)
+# stay on the primary this long; reads outside a session (background jobs, cache
+# reloads) do so after any commit. Tracked per process.
+DB_READ_YOUR_WRITES_SECONDS = float(os.getenv('DB_READ_YOUR_WRITES_SECONDS', DB_REPLICA_MAX_LAG))
+
+replica_lag = Gauge("db_replica_lag_seconds", "Replication lag reported by the last health check", ("replica",))
+replica_up = Gauge("db_replica_available", "1 if the replica currently receives reads", ("replica",))
+read_routing = Counter("db_read_connections_total", "Read-only connections by target and routing reason",
+                       ("target", "reason"))
+
+
+class Replica:
+    def __init__(self, index, address):
+        host, _, port = address.partition(':')
+        self.address = address
+        self.host = host
+        self.port = int(port) if port else None
+        self.pools = {role: RolePool(role, *config, host=host, port=self.port, name=f"{role}_replica{index}")
+                      for role, config in ROLE_POOLS.items()}
+
+        # No reads until the first health check passes
+        self.healthy = False
+        self.lag = None
+        self.checked_at = None
+        self.last_error = None
+        self.failures = 0
+
+    def available(self):
+        return self.healthy and self.lag <= DB_REPLICA_MAX_LAG
+
+    def _update(self, healthy, lag, error):
+        was_available = self.available()
+        self.healthy, self.lag, self.last_error = healthy, lag, error
+        self.checked_at = time.time()
+        if not healthy:
+            self.failures += 1
+        if lag is not None:
+            replica_lag.set(self.address, value=lag)
+        replica_up.set(self.address, value=int(self.available()))
+
+        if was_available and not self.available():
+            logger.warning(f"Replica {self.address} taken out of rotation: {error or f'lag {lag}s'}")
+        elif self.available() and not was_available:
+            logger.info(f"Replica {self.address} back in rotation (lag {lag}s)")
+
+    def record_check(self, lag):
+        if lag is None:
+            self._update(False, None, "replication is not running or not configured")
         else:
-            conn = employee_pool.get_connection()
+            self._update(True, lag, None)
+
+    def mark_down(self, error):
+        self._update(False, self.lag, error)
+
+    def stats(self):
+        return {
+            "available": self.available(),
+            "healthy": self.healthy,
+            "lag": self.lag,
+            "checked_at": self.checked_at,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+replicas = [Replica(index, address) for index, address in enumerate(DB_REPLICA_HOSTS, 1)]
+_round_robin = itertools.count()
+
+# session -> monotonic time of its last commit
+_recent_writes = {}
+_last_write = float('-inf')
+
+
+def record_write(session=None):
+    global _last_write
+    if not replicas:
+        return
+    _last_write = time.monotonic()
+    if session is not None:
+        _recent_writes[session] = _last_write
+
+
+def _pinned(session):
+    written = _last_write if session is None else _recent_writes.get(session, float('-inf'))
+    return time.monotonic() - written < DB_READ_YOUR_WRITES_SECONDS
+
+
+def _prune_writes():
+    cutoff = time.monotonic() - DB_READ_YOUR_WRITES_SECONDS
+    for session, written in list(_recent_writes.items()):
+        if written < cutoff:
+            del _recent_writes[session]
+
+
+# Runs in a worker thread. Lag in seconds, None when replication is stopped or not
+# configured at all (see DB_REPLICA_ALLOW_STANDALONE).
+def _replication_lag(replica):
+    options = {'port': replica.port} if replica.port else {}
+    conn = connect(host=replica.host, user=DB_REPLICA_MONITOR_USER, password=DB_REPLICA_MONITOR_PASSWORD,
+                   connection_timeout=DB_REPLICA_CHECK_TIMEOUT, **options)
+    try:
         cursor = conn.cursor(dictionary=True)
-        yield cursor, conn
-    finally:
+        try:
+            cursor.execute("SHOW REPLICA STATUS")
+        except Error as e:
+            if e.errno != errorcode.ER_PARSE_ERROR:
+                raise
+            # MySQL before 8.0.22
+            cursor.execute("SHOW SLAVE STATUS")
+        channels = cursor.fetchall()
         cursor.close()
+    finally:
         conn.close()
 
+    if not channels:
+        return 0.0 if DB_REPLICA_ALLOW_STANDALONE else None
+    lags = [channel.get('Seconds_Behind_Source', channel.get('Seconds_Behind_Master')) for channel in channels]
+    if any(lag is None for lag in lags):
+        return None
+    return float(max(lags))
+
+
+# Periodic job (started from main.py when replicas are configured)
+async def check_replicas():
+    _prune_writes()
+    for replica in replicas:
+        try:
+            lag = await run_db(_replication_lag, replica)
+        except Error as e:
+            replica.mark_down(str(e))
+        else:
+            replica.record_check(lag)
+
+
+def replica_stats():
+    return {
+        "max_lag": DB_REPLICA_MAX_LAG,
+        "read_your_writes_seconds": DB_READ_YOUR_WRITES_SECONDS,
+        "pinned_sessions": len(_recent_writes),
+        "replicas": {replica.address: replica.stats() for replica in replicas},
+        "routing": {f"{target} ({reason})": count for (target, reason), count in read_routing.series().items()},
+    }
+
+
+# Replica pool for a read-only connection, or None to use the primary
+def _read_replica(session):
+    if not replicas:
+        return None
+    if _pinned(session):
+        read_routing.inc("primary", "read_your_writes")
+        return None
+    available = [replica for replica in replicas if replica.available()]
+    if not available:
+        read_routing.inc("primary", "no_replica_available")
+        return None
+    return available[next(_round_robin) % len(available)]
+
+
+async def _acquire(role, read_only, session):
+    replica = _read_replica(session) if read_only else None
+    if replica is not None:
+        pool = replica.pools[role]
+        try:
+            conn, cursor = await pool.acquire()
+        except Error as e:
+            # Unreachable since the last check: leave it out until the next one passes
+            replica.mark_down(str(e))
+            read_routing.inc("primary", "replica_error")
+        except PoolTimeout:
+            # Saturated, not broken: this read goes to the primary, the replica stays in rotation
+            read_routing.inc("primary", "replica_busy")
+        else:
+            read_routing.inc(replica.address, "round_robin")
+            return pool, conn, cursor
+
+    pool = pools[role]
+    conn, cursor = await pool.acquire()
+    return pool, conn, cursor
+
+
+# Borrow a connection outside of a request (background jobs, streaming responses).
+# `read_only` connections may come from a replica; `session` identifies the caller
+# for read-your-writes.
+@asynccontextmanager
+async def db_connection(role='employee', read_only=False, session=None):
+    pool, conn, cursor = await _acquire(pool_role(role), read_only, session)
+    try:
+        yield AsyncCursor(cursor, conn), AsyncConnection(conn, session)
+    finally:
+        # Always hand the connection back, even if the request was cancelled
+        with anyio.CancelScope(shield=True):
+            await pool.release(conn, cursor)
+
+
+# Same as db_connection, but reports an exhausted pool as 503 to the client
+@asynccontextmanager
+async def request_connection(role='employee', read_only=False, session=None):
+    try:
+        async with db_connection(role, read_only, session) as db:
+            yield db
+    except PoolTimeout as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database busy, please retry")
+
+
+# Dependency for unauthenticated routes; authenticated routes use
+# core.security.get_role_db so the pool matches the caller's role
+async def get_db():
+    async with request_connection('employee') as db:
+        yield db
+
+
+# Bulk writes: items are applied in batches of DB_BULK_BATCH_SIZE with a single
+# thread hop and a single commit per batch. If anything in a batch fails, the batch
+# is rolled back and replayed item by item under savepoints, so only the bad items
+# are rejected. Returns one error message (or None) per item.
+DB_BULK_BATCH_SIZE = int(os.getenv('DB_BULK_BATCH_SIZE', 500))
+DB_BULK_MAX_ITEMS = int(os.getenv('DB_BULK_MAX_ITEMS', 10000))
+
+
+def _apply_batch(cursor, conn, items, apply):
+    try:
+        for item in items:
+            apply(cursor, item)
+        conn.commit()
+        return [None] * len(items)
+    except Error:
+        conn.rollback()
+
+    results = []
+    for item in items:
+        cursor.execute("SAVEPOINT bulk_item")
+        try:
+            apply(cursor, item)
+        except Error as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT bulk_item")
+            results.append(str(e))
+        else:
+            cursor.execute("RELEASE SAVEPOINT bulk_item")
+            results.append(None)
+    conn.commit()
+    return results
+
+
+async def run_in_batches(db, items, apply, batch_size=DB_BULK_BATCH_SIZE):
+    cursor, connection = db
+    results = []
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        results.extend(await run_db(_apply_batch, cursor._cursor, connection._conn, batch, apply))
+        record_write(connection._session)
+    return results
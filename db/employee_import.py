@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import uuid
+from itertools import islice
+
+from anyio import to_thread
+from pydantic import ValidationError
+
+from classes.employee import EmployeeCreate, EmployeeImportError, EmployeeImportReport
+from core.logs import configure_logging
+from core.photos import decode_inline, store_photo
+from db.db import DB_BULK_BATCH_SIZE, db_connection, run_in_batches
+
+IMPORT_FORMATS = ("csv", "json", "jsonl")
+
+
+# Argument list of the add_employee stored procedure
+def add_employee_params(employee):
+    return [employee.employee_id, employee.first_name, employee.last_name,
+            employee.birthday, employee.nic, employee.gender, employee.marital_status,
+            employee.number_of_dependents, employee.address, employee.contact_number,
+            employee.business_email, employee.job_title, employee.employee_status,
+            employee.department_name, employee.branch_name, employee.profile_photo,
+            employee.emergency_contact_name, employee.emergency_contact_nic,
+            employee.emergency_contact_address, employee.emergency_contact_number]
+
+
+def _add_employee(cursor, employee):
+    cursor.callproc("add_employee", add_employee_params(employee))
+
+
+def import_format(filename, content_type=None):
+    extension = os.path.splitext(filename or "")[1].lstrip(".").lower()
+    if extension == "ndjson":
+        extension = "jsonl"
+    if extension in IMPORT_FORMATS:
+        return extension
+    if content_type == "text/csv":
+        return "csv"
+    if content_type in ("application/x-ndjson", "application/jsonl"):
+        return "jsonl"
+    if content_type == "application/json":
+        return "json"
+    return None
+
+
+# Yield (row number, record) pairs from a binary file. CSV and JSON Lines are read
+# lazily; a plain JSON array has to be parsed as a whole. The file is left open.
+def read_rows(file, fmt):
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        if fmt == "csv":
+            # Row 1 is the header. A malformed file stops the import; the error names
+            # the physical line, which differs from the row number for quoted newlines.
+            reader = csv.DictReader(text)
+            try:
+                for number, row in enumerate(reader, start=2):
+                    yield number, row
+            except csv.Error as e:
+                raise csv.Error(f"line {reader.reader.line_num}: {e}") from e
+        elif fmt == "jsonl":
+            for number, line in enumerate(text, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield number, json.loads(line)
+                except ValueError as e:
+                    yield number, e
+        else:
+            for number, row in enumerate(json.load(text), start=1):
+                yield number, row
+    finally:
+        text.detach()
+
+
+# Rows are inserted chunk by chunk as they are read, so an undecodable byte or a
+# malformed CSV line near the end would surface after earlier chunks are committed.
+# One read-only pass over the whole file first raises those errors before anything
+# is inserted; the file is then rewound for the import. A JSON array is parsed
+# whole before its first row anyway.
+def check_readable(file, fmt):
+    if fmt != "json":
+        for _ in read_rows(file, fmt):
+            pass
+    file.seek(0)
+
+
+def _validate(record):
+    if isinstance(record, Exception):
+        return None, None, [f"Invalid JSON: {record}"]
+    if not isinstance(record, dict):
+        return None, None, ["Row is not an object"]
+
+    # Empty CSV cells mean "not provided"; ids are always assigned here, as in /employee/new
+    record = {key: (None if value == "" else value) for key, value in record.items() if key}
+    record["employee_id"] = str(uuid.uuid4())
+    try:
+        employee = EmployeeCreate(**record)
+    except ValidationError as e:
+        return None, None, [f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()]
+
+    # Only the reference of an inline photo is inserted; the image itself is stored
+    # once its row has been committed
+    try:
+        employee.profile_photo, photo = decode_inline(employee.profile_photo)
+    except ValueError as e:
+        return None, None, [f"profile_photo: {e}"]
+    return employee, photo, None
+
+
+def _store_photos(photos):
+    for reference, data in photos:
+        store_photo(reference, data)
+
+
+# Validate and insert the rows chunk by chunk: parsing and validation happen off
+# the event loop, each chunk is inserted with run_in_batches (one commit per chunk)
+# and every rejected row is reported with its row number
+async def import_employees(db, rows, chunk_size=DB_BULK_BATCH_SIZE):
+    report = EmployeeImportReport()
+    while True:
+        chunk = await to_thread.run_sync(
+            lambda: [(number, *_validate(record)) for number, record in islice(rows, chunk_size)])
+        if not chunk:
+            break
+
+        numbers, employees, photos = [], [], []
+        for number, employee, photo, errors in chunk:
+            report.total += 1
+            if errors:
+                report.errors.append(EmployeeImportError(row=number, errors=errors))
+            else:
+                numbers.append(number)
+                employees.append(employee)
+                photos.append(photo)
+
+        if employees:
+            results = await run_in_batches(db, employees, _add_employee, batch_size=len(employees))
+            inserted_photos = []
+            for number, employee, photo, error in zip(numbers, employees, photos, results):
+                if error is None:
+                    report.imported += 1
+                    if photo is not None:
+                        inserted_photos.append((employee.profile_photo, photo))
+                else:
+                    report.errors.append(EmployeeImportError(row=number, errors=[error]))
+            if inserted_photos:
+                await to_thread.run_sync(_store_photos, inserted_photos)
+
+    report.failed = report.total - report.imported
+    report.errors.sort(key=lambda error: error.row)
+    return report
+
+
+async def _import_file(path, fmt, role):
+    with open(path, "rb") as file:
+        check_readable(file, fmt)
+        async with db_connection(role) as db:
+            return await import_employees(db, read_rows(file, fmt))
+
+
+# python -m db.employee_import employees.csv
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import employees from a CSV, JSON or JSON Lines file")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=IMPORT_FORMATS)
+    parser.add_argument("--role", default="admin", help="database pool to use (default: admin)")
+    args = parser.parse_args()
+    configure_logging()
+
+    fmt = args.format or import_format(args.path)
+    if fmt is None:
+        parser.error("cannot tell the file format from its name; pass --format")
+
+    report = asyncio.run(_import_file(args.path, fmt, args.role))
+    print(report.model_dump_json(indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+from datetime import timedelta
+
+from core.events import leave_events
+from db.db import DB_BULK_BATCH_SIZE, db_connection, prepared
+
+LEAVE_PAGE_DEFAULT = 100
+LEAVE_PAGE_MAX = 1000
+
+LEAVE_BY_ID = prepared("SELECT * FROM leave_request WHERE leave_request_id = %s")
+SUPERVISORS_BY_EMPLOYEE = prepared("SELECT supervisor_id FROM supervisor WHERE employee_id = %s")
+
+
+# Keyset-paginated leave listing: rows come back ordered by leave_request_id and
+# `after` is the last id the client has seen, so every page is an index range scan
+# no matter how deep into the history it is
+def leave_page_query(limit, after=None, supervisor_id=None, status=None, from_date=None, to_date=None):
+    clauses = []
+    params = []
+
+    if after is not None:
+        clauses.append("leave_request.leave_request_id > %s")
+        params.append(after)
+    if supervisor_id is not None:
+        clauses.append("leave_request.employee_id IN (SELECT employee_id FROM supervisor WHERE supervisor_id = %s)")
+        params.append(supervisor_id)
+    if status is not None:
+        clauses.append("leave_request.request_status = %s")
+        params.append(status)
+    if from_date is not None:
+        clauses.append("leave_request.request_date >= %s")
+        params.append(from_date)
+    if to_date is not None:
+        # request_date is a DATETIME; the whole to_date day is included
+        clauses.append("leave_request.request_date < %s")
+        params.append(to_date + timedelta(days=1))
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    query = f"""
+        SELECT leave_request.leave_request_id, leave_request.employee_id, employee.first_name, employee.last_name,
+               employee.gender, leave_request.request_date, leave_request.leave_start_date,
+               leave_request.period_of_absence, leave_request.reason_for_absence, leave_request.type_of_leave,
+               leave_request.request_status
+        FROM leave_request
+        JOIN employee ON employee.employee_id = leave_request.employee_id
+        {where}
+        ORDER BY leave_request.leave_request_id
+        LIMIT %s
+    """
+    params.append(limit)
+    return query, tuple(params)
+
+
+async def fetch_leave_page(cursor, limit, **filters):
+    query, params = leave_page_query(limit, **filters)
+    await cursor.execute(query, params)
+    return await cursor.fetchall()
+
+
+# Yield every matching row, one keyset page at a time. A connection is only held
+# while a page is being read, so a slow client does not pin a pooled connection.
+# Pages may be read from a replica (see db.db).
+async def stream_leaves(role, batch_size=LEAVE_PAGE_MAX, after=None, session=None, **filters):
+    while True:
+        async with db_connection(role, read_only=True, session=session) as (cursor, _):
+            rows = await fetch_leave_page(cursor, batch_size, after=after, **filters)
+
+        for row in rows:
+            yield row
+
+        if len(rows) < batch_size:
+            return
+        after = rows[-1]['leave_request_id']
+
+
+# Supervisors to notify about changes to an employee's leave requests
+async def employee_supervisors(cursor, employee_id):
+    await cursor.execute(SUPERVISORS_BY_EMPLOYEE, (employee_id,))
+    return [row['supervisor_id'] for row in await cursor.fetchall()]
+
+
+# Supervisors of each of the given employees, keyed by employee_id
+async def employees_supervisors(cursor, employee_ids):
+    employee_ids = list(dict.fromkeys(employee_ids))
+    supervisors = {employee_id: [] for employee_id in employee_ids}
+    for start in range(0, len(employee_ids), DB_BULK_BATCH_SIZE):
+        chunk = employee_ids[start:start + DB_BULK_BATCH_SIZE]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        await cursor.execute(f"SELECT employee_id, supervisor_id FROM supervisor WHERE employee_id IN ({placeholders})",
+                             tuple(chunk))
+        for row in await cursor.fetchall():
+            supervisors[row['employee_id']].append(row['supervisor_id'])
+    return supervisors
+
+
+# Owner and supervisors of each leave request, keyed by leave_request_id
+async def leave_owners(cursor, leave_request_ids):
+    owners = {}
+    for start in range(0, len(leave_request_ids), DB_BULK_BATCH_SIZE):
+        chunk = leave_request_ids[start:start + DB_BULK_BATCH_SIZE]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        await cursor.execute(f"""
+            SELECT leave_request.leave_request_id, leave_request.employee_id, supervisor.supervisor_id
+            FROM leave_request
+            LEFT JOIN supervisor ON supervisor.employee_id = leave_request.employee_id
+            WHERE leave_request.leave_request_id IN ({placeholders})
+        """, tuple(chunk))
+
+        for row in await cursor.fetchall():
+            _, supervisors = owners.setdefault(row['leave_request_id'], (row['employee_id'], []))
+            if row['supervisor_id'] is not None:
+                supervisors.append(row['supervisor_id'])
+    return owners
+
+
+# Notify the supervisors of each leave request in `owners` (see leave_owners)
+def publish_leave_events(event_type, owners, **fields):
+    for leave_request_id, (employee_id, supervisors) in owners.items():
+        leave_events.publish(supervisors, dict(fields, type=event_type, leave_request_id=leave_request_id,
+                                               employee_id=employee_id))
@@ -1,21 +1,63 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
-from API import employee, users,Leavings,supervisor,listings
+from API import employee, users,Leavings,supervisor,listings,monitoring
 from fastapi.middleware.cors import CORSMiddleware
+from core.admission import AdmissionMiddleware
+from core.compression import CompressionMiddleware
+from core.logs import configure_logging
+from core.metrics import RequestMetricsMiddleware
+from core.jobs import start_periodic
+from core.revocation import REVOCATION_REFRESH_SECONDS, revocation_list
+from core.stats import stats_cache
+from db.db import DB_REPLICA_CHECK_SECONDS, check_replicas, replicas
+
+
+configure_logging()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the dashboard aggregates in the background so the first readers hit a warm cache
+    stats_cache.warm()
+    eotm_job = start_periodic(employee.EOTM_REFRESH_SECONDS, employee.refresh_employee_of_the_month)
+    # Replicas only receive reads once a health check has passed
+    replica_job = start_periodic(DB_REPLICA_CHECK_SECONDS, check_replicas) if replicas else None
+    # Loads every unexpired revoked token, then polls for new revocations
+    revocation_job = start_periodic(REVOCATION_REFRESH_SECONDS, revocation_list.refresh)
+    yield
+    eotm_job.cancel()
+    revocation_job.cancel()
+    if replica_job:
+        replica_job.cancel()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+# Middleware added last runs first
+# gzip (or brotli when installed) for JSON/NDJSON bodies above COMPRESSION_MIN_SIZE
+app.add_middleware(CompressionMiddleware)
+# 503 for new requests while too many are already queued for a DB connection
+app.add_middleware(AdmissionMiddleware)
+# Per-route latency/status metrics; also lets the DB layer label queries by route
+app.add_middleware(RequestMetricsMiddleware)
+# Outermost, so responses produced by the middleware above (e.g. Admission's 503)
+# carry CORS headers too
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Adjust this for specific origins
     allow_credentials=True,
     allow_methods=["*"],  # Ensure POST is allowed
     allow_headers=["*"],
+    # Pagination cursors, validators and back-off hints must be readable by browser clients
+    expose_headers=["X-Next-Cursor", "ETag", "Retry-After"],
 )
 app.include_router(employee.router)
 app.include_router(users.router)
 app.include_router(Leavings.router)
 app.include_router(supervisor.router)
 app.include_router(listings.router)
+app.include_router(monitoring.router)
 
 #
 @app.get("/")